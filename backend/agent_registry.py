@@ -0,0 +1,81 @@
+import hashlib
+import json
+import os
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from threading import Lock
+from typing import Any, Callable, Iterator, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: only the in-process lock applies
+    fcntl = None  # type: ignore[assignment]
+
+
+def config_hash(config: dict[str, Any]) -> str:
+    """Stable hash of an agent configuration (prompt, tools, model, voice settings)."""
+    encoded = json.dumps(config, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class AgentRegistry:
+    """
+    Persistent map: configuration hash -> created Retell agent ({"agent_id", "llm_id", "created_at"}).
+    Entries are cached in memory and stored in a JSON file, so an agent is created
+    once per configuration and reused across calls and restarts.
+    Creating an entry holds an exclusive lock on <path>.lock and re-reads the file first,
+    so several processes sharing the file create only one agent per configuration.
+    """
+
+    def __init__(self, path: str = "sessions/agent_registry.json"):
+        self.path = Path(path)
+        self.lock_path = self.path.with_name(self.path.name + ".lock")
+        self._lock = Lock()
+        self._entries: Optional[dict[str, dict[str, Any]]] = None
+
+    def get_or_create(self, key: str, factory: Callable[[], dict[str, Any]]) -> dict[str, Any]:
+        """
+        Returns the entry for key, calling factory() to build it if missing.
+        The locks are held while building, so concurrent callers (threads or processes) create only one agent.
+        """
+        with self._lock:
+            if self._entries is not None and key in self._entries:
+                return self._entries[key]
+            # Created on first use (the lock file lives there too), not on import
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with self._file_lock():
+                # Another process may have added the entry since this one last read the file
+                entries = self._read_file()
+                if key not in entries:
+                    entries[key] = factory()
+                    self._atomic_write(entries)
+                self._entries = entries
+                return entries[key]
+
+    # --- internal ---
+
+    @contextmanager
+    def _file_lock(self) -> Iterator[None]:
+        if fcntl is None:
+            yield
+            return
+        with open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_file(self) -> dict[str, dict[str, Any]]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _atomic_write(self, entries: dict[str, dict[str, Any]]) -> None:
+        tmp = self.path.with_suffix(f".{uuid.uuid4().hex}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(entries, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.path)
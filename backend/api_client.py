@@ -0,0 +1,243 @@
+"""
+Rate limiting and retries for the remote API clients (OpenAI, Retell).
+RateLimitedClient wraps an SDK client; every call such as client.files.create(...) goes through
+a per-endpoint token bucket, a shared concurrency bound and jittered exponential backoff.
+LazyClient creates the wrapped client on first use.
+"""
+import os
+import random
+import threading
+import time
+from typing import Any, Callable, Optional, TYPE_CHECKING
+
+import metrics
+
+if TYPE_CHECKING:
+    import httpx
+
+API_REQUESTS = metrics.counter("api_requests_total", "Remote API calls by outcome", ("api", "endpoint", "outcome"))
+API_RETRIES = metrics.counter("api_retries_total", "Retried remote API calls by reason", ("api", "endpoint", "reason"))
+API_THROTTLE_SECONDS = metrics.histogram(
+    "api_throttle_seconds", "Time calls waited for a rate limit token or a concurrency slot", ("api",)
+)
+
+# Statuses that mean the request was not processed and may be sent again
+RETRYABLE_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """Allows `rate` acquisitions per second on average, with bursts of up to `burst` (rate <= 0: no limit)."""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Takes a token, sleeping until one is available. Returns the seconds waited."""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # Reserve the token now; a negative balance is the queue of waiting callers
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+def parse_rate_limits(spec: str) -> dict[str, float]:
+    """Parses "files.create=5,responses.create=2" (requests per second per endpoint)."""
+    limits: dict[str, float] = {}
+    for item in spec.split(","):
+        if "=" in item:
+            endpoint, rate = item.split("=", 1)
+            limits[endpoint.strip()] = float(rate)
+    return limits
+
+
+def pooled_http_client(max_connections: int) -> "httpx.Client":
+    """An httpx client whose keep-alive pool matches the number of concurrent calls."""
+    import httpx
+
+    return httpx.Client(
+        limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        timeout=httpx.Timeout(600.0, connect=10.0),
+    )
+
+
+class _Limits:
+    """State shared by all wrappers of one API: buckets, concurrency slots and retry policy."""
+
+    def __init__(self, api: str, rate_limits: dict[str, float], default_rate: float, max_concurrency: int,
+                 max_retries: int, base_delay: float, max_delay: float, idempotent: set[str],
+                 connection_errors: tuple[type[BaseException], ...]):
+        self.api = api
+        self.buckets = {endpoint: TokenBucket(rate) for endpoint, rate in rate_limits.items()}
+        self.default_bucket = TokenBucket(default_rate)
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.idempotent = idempotent
+        self.connection_errors = connection_errors
+
+
+class RateLimitedClient:
+    """
+    Wraps an SDK client so that every remote call is rate limited and retried.
+    - api: name used in metrics ("openai", "retell")
+    - rate_limits: requests per second per endpoint ("files.create"); others use default_rate (0: unlimited)
+    - max_concurrency: calls in flight at once across all endpoints
+    - max_retries: retries after the first attempt
+    - idempotent: endpoints also retried after connection errors and 5xx responses;
+      other endpoints (e.g. placing a phone call) are only retried when the API refused them (408/409/429)
+    - connection_errors: the SDK's connection error types
+
+    The delay before a retry is exponential backoff with full jitter, on top of the Retry-After
+    header when present. Configure the SDK client with max_retries=0 so retries happen only here.
+    """
+
+    def __init__(
+        self,
+        client: Any,
+        api: str,
+        rate_limits: Optional[dict[str, float]] = None,
+        default_rate: float = 0.0,
+        max_concurrency: int = 8,
+        max_retries: int = 4,
+        base_delay: float = 0.5,
+        max_delay: float = 30.0,
+        idempotent: Optional[set[str]] = None,
+        connection_errors: tuple[type[BaseException], ...] = (),
+        _limits: Optional[_Limits] = None,
+    ):
+        self._client = client
+        self._path = ""
+        self._limits = _limits or _Limits(
+            api, rate_limits or {}, default_rate, max_concurrency, max_retries,
+            base_delay, max_delay, idempotent or set(), connection_errors,
+        )
+
+    def wrap(self, client: Any) -> "RateLimitedClient":
+        """Wraps another client (e.g. a fake in benchmarks) under the same limits."""
+        return RateLimitedClient(client, self._limits.api, _limits=self._limits)
+
+    def __getattr__(self, name: str) -> Any:
+        target = getattr(self._client, name)
+        if isinstance(target, _PLAIN_TYPES) or (callable(target) and not self._path):
+            # Settings and client-level helpers (e.g. Retell's verify) run locally
+            return target
+        path = f"{self._path}.{name}" if self._path else name
+        if callable(target):
+            return _RateLimitedCall(target, path, self._limits)
+        # A resource (client.files, client.call): wrap its methods too
+        child = RateLimitedClient(target, self._limits.api, _limits=self._limits)
+        child._path = path
+        return child
+
+
+_PLAIN_TYPES = (str, bytes, int, float, bool, type(None), dict, list, tuple)
+
+
+class _RateLimitedCall:
+    def __init__(self, fn: Callable[..., Any], endpoint: str, limits: _Limits):
+        self._fn = fn
+        self._endpoint = endpoint
+        self._limits = limits
+
+    def __call__(self, *args: Any, **kwargs: Any) -> Any:
+        limits = self._limits
+        bucket = limits.buckets.get(self._endpoint, limits.default_bucket)
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            bucket.acquire()
+            with limits.slots:
+                API_THROTTLE_SECONDS.observe(time.perf_counter() - start, api=limits.api)
+                try:
+                    result = self._fn(*args, **kwargs)
+                except Exception as e:
+                    reason, retry_after = self._classify(e)
+                    if reason is None or attempt >= limits.max_retries:
+                        API_REQUESTS.inc(api=limits.api, endpoint=self._endpoint, outcome="error")
+                        raise
+                else:
+                    API_REQUESTS.inc(api=limits.api, endpoint=self._endpoint, outcome="ok")
+                    return result
+            # Back off outside the concurrency slot
+            API_RETRIES.inc(api=limits.api, endpoint=self._endpoint, reason=reason)
+            # Jitter spreads out callers that were refused together; Retry-After is the minimum wait
+            delay = (retry_after or 0.0) + random.uniform(0, min(limits.max_delay, limits.base_delay * 2 ** attempt))
+            print(f"[API] {limits.api} {self._endpoint} failed ({reason}), retry {attempt + 1} in {delay:.2f}s")
+            time.sleep(delay)
+            attempt += 1
+
+    def _classify(self, e: Exception) -> tuple[Optional[str], Optional[float]]:
+        """Returns (retry reason or None if not retryable, Retry-After seconds or None)."""
+        idempotent = self._endpoint in self._limits.idempotent
+        if isinstance(e, self._limits.connection_errors):
+            return ("connection", None) if idempotent else (None, None)
+        status = getattr(e, "status_code", None)
+        if status not in RETRYABLE_STATUSES:
+            return None, None
+        if status >= 500 and not idempotent:
+            return None, None
+        return str(status), _retry_after(getattr(e, "response", None))
+
+
+def _retry_after(response: Any) -> Optional[float]:
+    """Seconds from a Retry-After (or retry-after-ms) header, if any."""
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        pass  # HTTP-date form: fall back to backoff
+    return None
+
+
+class LazyClient:
+    """
+    A RateLimitedClient created on first use, so importing a module that holds one needs
+    neither the SDK nor an API key.
+    - factory: creates the SDK client (imports the SDK, reads the API key)
+    - rate_limited: wraps an SDK-shaped client in the API's rate limiting and retries
+    A forked child starts without a client: it must not share the parent's connection pool.
+    """
+
+    def __init__(self, factory: Callable[[], Any], rate_limited: Callable[[Any], RateLimitedClient]):
+        self._factory = factory
+        self._rate_limited = rate_limited
+        self._client: Optional[RateLimitedClient] = None
+        self._lock = threading.Lock()
+        os.register_at_fork(after_in_child=self._reset)
+
+    def get(self) -> RateLimitedClient:
+        """The client, created on first use."""
+        with self._lock:
+            if self._client is None:
+                self._client = self._rate_limited(self._factory())
+            return self._client
+
+    def set(self, client: Any) -> None:
+        """
+        Replaces the client, e.g. with a fake in benchmarks.
+        - client: an SDK-shaped client, wrapped in the same rate limiting and retries unless it is
+          a RateLimitedClient already; None goes back to creating the real client on first use
+        """
+        with self._lock:
+            if client is not None and not isinstance(client, RateLimitedClient):
+                client = self._rate_limited(client)
+            self._client = client
+
+    def _reset(self) -> None:
+        self._client = None
+        self._lock = threading.Lock()
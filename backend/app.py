@@ -1,15 +1,23 @@
+import base64
 import json
-from flask import Flask, request, jsonify
-from werkzeug.utils import secure_filename
+from datetime import datetime
+from flask import Flask, Response, request, jsonify
 import os
 from flask_cors import CORS
-from file_store import FileSessionStore
-from create_session import create_session
+from session_store import open_store
+from blob_store import load_blobs
+from create_session import create_pending_session, try_cached_session, on_session_ready
+from parse_doc import parse_cache
+from ingestion import IngestionPool
+from upload_store import UploadRequest, store_upload
+import metrics
 
 # from apscheduler.schedulers.background import BackgroundScheduler # type: ignore  # pyright: ignore[reportMissingTypeStubs]
 from flask_apscheduler import APScheduler # type: ignore
 
-from initial_call import make_patient_call, wait_for_call_completion
+from call_dispatcher import CallDispatcher
+from initial_call import verify_webhook, make_patient_call
+from reminders import ReminderScheduler
 
 
 app = Flask(__name__)
@@ -18,8 +26,46 @@ cors = CORS(app, origins='*')
 upload_folder = "uploaded_notes"
 os.makedirs(upload_folder, exist_ok=True)
 
-store = FileSessionStore(base_dir="sessions", ext=".json")
+# Uploads are streamed into upload_folder and hashed while they arrive (see upload_store)
+MAX_UPLOAD_BYTES = int(float(os.environ.get("MAX_UPLOAD_MB", "25")) * 1024 * 1024)
+UploadRequest.upload_dir = upload_folder
+UploadRequest.max_file_bytes = MAX_UPLOAD_BYTES
+app.request_class = UploadRequest
+# Room for the multipart headers around the file
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES + 64 * 1024
+
+store = open_store(base_dir="sessions")
 scheduler = APScheduler()
+reminders = ReminderScheduler(
+    store,
+    call_fn=make_patient_call,
+    max_concurrent_calls=int(os.environ.get("REMINDER_CALL_WORKERS", "2")),
+    missed_grace_seconds=float(os.environ.get("REMINDER_GRACE_SECONDS", "3600")),
+    timezone=os.environ.get("REMINDER_TIMEZONE"),
+)
+dispatcher = CallDispatcher(
+    store,
+    max_concurrent_calls=int(os.environ.get("MAX_CONCURRENT_CALLS", "4")),
+    max_queue_size=int(os.environ.get("CALL_QUEUE_SIZE", "100")),
+    call_timeout_seconds=float(os.environ.get("CALL_TIMEOUT_SECONDS", "3600")),
+    on_call_completed=reminders.schedule_session,
+    worker_id=os.environ.get("WORKER_ID"),
+    lease_seconds=float(os.environ.get("CALL_LEASE_SECONDS", "120")),
+)
+ingestion = IngestionPool(store, max_workers=int(os.environ.get("INGESTION_WORKERS", "4")))
+
+JOB_SECONDS = metrics.histogram("scheduler_job_seconds", "Time per scheduler job run", ("job",))
+UPLOADS = metrics.counter("uploads_total", "Uploaded documents by result", ("result",))
+DUPLICATE_UPLOADS = metrics.counter("upload_duplicates_total", "Uploads whose content was already stored")
+on_session_ready(dispatcher.notify)
+metrics.callback("call_dispatcher", "Call dispatcher state: queued, active_calls, slots", dispatcher.stats, "state")
+metrics.callback("reminders", "Reminder scheduler state: scheduled, calls_in_progress", reminders.stats, "state")
+metrics.callback("ingestion_in_progress", "Documents being parsed", lambda: {"": ingestion.stats()["in_progress"]})
+
+
+@app.errorhandler(413)
+def upload_too_large(e):
+    return jsonify({'error': f'File is larger than {MAX_UPLOAD_BYTES // (1024 * 1024)} MB'}), 413
 
 
 @app.route('/api/upload', methods=['POST'])
@@ -32,84 +78,205 @@ def upload_note():
     if file.filename == '' or file.filename is None:
         return jsonify({'error': 'Empty filename'}), 400
 
-    # Saving the file on the server with a safe name
-    filename = secure_filename(file.filename)
-    file_path = os.path.join(upload_folder, filename)
-    file.save(file_path)
+    # The file is already on disk and hashed; identical content shares one stored file
+    try:
+        upload = store_upload(file.stream, file.filename, upload_folder)
+    except OSError as e:
+        print(e)
+        UPLOADS.inc(result='failed')
+        return jsonify({'error': 'Failed to store file'}), 500
+    if upload.duplicate:
+        DUPLICATE_UPLOADS.inc()
 
-    # Creating a new session (details will be implemented on the next steps)
-    # function create_session will be implemented later
+    # Creating the session right away; the document is parsed in the background
     try:
-        session_id = create_session(file_path, store)
+        session_id = create_pending_session(upload.path, store, file_info={
+            'file_sha256': upload.sha256,
+            'file_size': upload.size,
+            'original_filename': upload.original_filename,
+        })
     except Exception as e:
         print(e)
+        UPLOADS.inc(result='failed')
         return jsonify({'error': 'Failed to create session'}), 500
 
-    return jsonify({'message': 'File uploaded', 'session_id': session_id}), 200
+    # A document that was parsed before is ready right away
+    if try_cached_session(session_id, store):
+        UPLOADS.inc(result='cached')
+        return jsonify({'message': 'File uploaded', 'session_id': session_id, 'status': 'new'}), 200
+    ingestion.submit(session_id)
+    UPLOADS.inc(result='queued')
+
+    return jsonify({
+        'message': 'File uploaded',
+        'session_id': session_id,
+        'status': 'parsing',
+        'status_url': f'/api/sessions/{session_id}/status',
+    }), 202
+
+
+@app.route('/api/sessions/<session_id>/status', methods=['GET'])
+def get_session_status(session_id):
+    # ?wait=<seconds> long-polls until parsing is finished
+    wait = min(request.args.get('wait', default=0, type=float), 60.0)
+    try:
+        sess = ingestion.wait(session_id, wait) if wait > 0 else store.get(session_id)
+    except FileNotFoundError:
+        return jsonify({'error': 'Session not found'}), 404
+
+    result = {'session_id': session_id, 'status': sess.get('status')}
+    if sess.get('error'):
+        result['error'] = sess['error']
+    return jsonify(result), 200
+
+
+@app.route('/api/sessions/<session_id>/reminders', methods=['PUT'])
+def replace_reminders(session_id):
+    # Body: {"callSchedules": [{"medicationName": ..., "time": "8:00 AM every day"}, ...]}
+    # Used to fix sessions in "needs_review", whose spoken reminder times could not be understood
+    body = request.get_json(silent=True) or {}
+    if not isinstance(body.get('callSchedules'), list):
+        return jsonify({'error': 'callSchedules must be a list'}), 400
+    try:
+        result = reminders.replace_schedules(session_id, body['callSchedules'])
+    except FileNotFoundError:
+        return jsonify({'error': 'Session not found'}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 409
+    if result is None:
+        return jsonify({'error': 'Session changed meanwhile, try again'}), 409
+    return jsonify({'session_id': session_id, **result}), 200
+
+
+# Session fields returned by /api/sessions unless ?fields= asks for others
+LIST_FIELDS = ('status', 'created_at', 'completed_at', 'file_path', 'call_id', 'error')
+LIST_MAX_LIMIT = 200
+
+
+def _parse_time(value):
+    """Unix seconds or an ISO 8601 date/time"""
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def _encode_cursor(session_id, sess):
+    raw = json.dumps([sess.get('created_at') or 0.0, session_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def _decode_cursor(value):
+    created_at, session_id = json.loads(base64.urlsafe_b64decode(value.encode('ascii')))
+    return float(created_at), str(session_id)
+
+
+@app.route('/api/sessions', methods=['GET'])
+def list_sessions():
+    # ?status= &created_after= &created_before= &limit= &cursor= &fields=a,b &expand_blobs=1
+    try:
+        created_after = _parse_time(request.args.get('created_after'))
+        created_before = _parse_time(request.args.get('created_before'))
+        cursor = _decode_cursor(request.args['cursor']) if request.args.get('cursor') else None
+    except (ValueError, TypeError):
+        return jsonify({'error': 'Invalid time filter or cursor'}), 400
+    limit = max(1, min(request.args.get('limit', default=50, type=int), LIST_MAX_LIMIT))
+    fields = [f for f in request.args.get('fields', ','.join(LIST_FIELDS)).split(',') if f]
+    expand_blobs = request.args.get('expand_blobs') in ('1', 'true')
+
+    # One extra row tells whether there is a next page
+    page = store.list_sessions(
+        status=request.args.get('status') or None,
+        created_after=created_after,
+        created_before=created_before,
+        cursor=cursor,
+        limit=limit + 1,
+    )
+    has_more = len(page) > limit
+    page = page[:limit]
+
+    sessions = []
+    for session_id, sess in page:
+        item = {'session_id': session_id, **{f: sess[f] for f in fields if f in sess}}
+        # Transcripts and document texts stay references unless asked for
+        sessions.append(load_blobs(store, item) if expand_blobs else item)
+
+    resp = jsonify({
+        'sessions': sessions,
+        'next_cursor': _encode_cursor(*page[-1]) if has_more else None,
+    })
+    # Dashboards poll this: an unchanged page is answered with 304 Not Modified
+    resp.cache_control.no_cache = True
+    resp.add_etag()
+    return resp.make_conditional(request)
+
+
+@app.route('/api/parse-cache/stats', methods=['GET'])
+def get_parse_cache_stats():
+    return jsonify(parse_cache.stats()), 200
+
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.REGISTRY.render(), mimetype='text/plain; version=0.0.4')
 
 
 @app.route('/api/users', methods=['GET'])
 def get_users():
     return jsonify({'message': 'Users fetched'}), 200
 
-@scheduler.task('interval', id='check_new_sessions', seconds=5)
+@app.route('/api/retell/webhook', methods=['POST'])
+def retell_webhook():
+    # The signature covers the raw body, so verify before parsing
+    body = request.get_data(as_text=True)
+    if not verify_webhook(body, request.headers.get('X-Retell-Signature', '')):
+        return jsonify({'error': 'Invalid signature'}), 401
+
+    event = json.loads(body)
+    if event.get('event') != 'call_ended':
+        return jsonify({'message': 'Ignored'}), 200
+
+    call = event.get('call') or {}
+    session_id = reminders.complete_call(call.get('call_id', ''), call)
+    if session_id is None:
+        session_id = dispatcher.complete_call(call.get('call_id', ''), call)
+    if session_id is None:
+        # Not known (yet): Retell retries the event, the sweep catches it otherwise
+        return jsonify({'error': 'Unknown call'}), 404
+    return jsonify({'message': 'Call processed', 'session_id': session_id}), 200
+
+
+@scheduler.task('interval', id='check_new_sessions', seconds=int(os.environ.get("DISPATCH_SWEEP_SECONDS", "300")))
+@JOB_SECONDS.time(job='check_new_sessions')
 def check_new_sessions():
-    print("Checking new sessions")
-    # Go through sessions and find new ones
-    for session_id, sess in list(store.get_by_status('new').items()):
-        print(f"[Scheduler] New session {session_id}, starting first call.")
-        # Mark session as processed, so that we don't call it again
-        store.update(session_id, {'status': 'calling'})
-        # function to start the call, implement in step 5
-        print(f"[Scheduler] Starting first call for session {session_id}")
-        phone_call = make_patient_call(store.get(session_id)["data"])
-        final_call_details = wait_for_call_completion(phone_call.call_id)
-        print(f"[Scheduler] First call completed for session {session_id}")
-
-        if final_call_details and final_call_details.collected_dynamic_variables:
-            # Get the medication reminder preferences
-            call_schedules = final_call_details.collected_dynamic_variables.get('callSchedules')
-            
-            if call_schedules == "not required":
-                print("Patient doesn't want medication reminders")
-            else:
-                # Parse the JSON array of medication schedules
-                # schedules = json.loads(call_schedules)
-                print(f"Medication reminders needed: {call_schedules}")
-                
-            # Store results
-            store.update(session_id, {
-                'status': 'initial_call_completed',
-                'callSchedules': call_schedules
-            })
-
-
-
-
-        if final_call_details:
-            print(f"[Scheduler] Call completed for session {session_id}")
-            
-            # Extract any collected data from the call
-            collected_data = final_call_details.collected_dynamic_variables or {}
-            transcript = final_call_details.transcript or ""
-            
-            # Store the results
-            store.update(session_id, {
-                'status': 'initial_call_completed',
-                'call_results': {
-                    'call_id': phone_call.call_id,
-                    'transcript': transcript,
-                    'collected_data': collected_data,
-                    'call_status': final_call_details.call_status,
-                    'disconnection_reason': final_call_details.disconnection_reason
-                }
-            })
-            
-            print(f"[Scheduler] Results stored for session {session_id}")
-        else:
-            # Handle timeout or error
-            store.update(session_id, {'status': 'call_failed'})
-            print(f"[Scheduler] Call failed or timed out for session {session_id}")
+    # Recovery sweep: new sessions normally reach the dispatcher through on_session_ready
+    dispatcher.submit_waiting()
+
+
+@scheduler.task('interval', id='sweep_active_calls', seconds=int(os.environ.get("CALL_SWEEP_SECONDS", "60")))
+@JOB_SECONDS.time(job='sweep_active_calls')
+def sweep_active_calls():
+    # Polling fallback: calls normally finish through the webhook
+    dispatcher.sweep_active_calls()
+
+
+@scheduler.task('interval', id='archive_sessions', seconds=3600)
+@JOB_SECONDS.time(job='archive_sessions')
+def archive_sessions():
+    # Keeps the session index small as history grows
+    days = float(os.environ.get("SESSION_ARCHIVE_DAYS", "30"))
+    archive = getattr(store, "archive_completed", None)
+    if days > 0 and archive is not None:
+        archive(days * 86400)
+
+
+@scheduler.task('interval', id='reap_expired_leases', seconds=int(os.environ.get("LEASE_REAP_SECONDS", "30")))
+@JOB_SECONDS.time(job='reap_expired_leases')
+def reap_expired_leases():
+    # Sessions claimed by a scheduler process that died go back to "new"
+    dispatcher.reap_expired_leases()
 
 
 # # Register task in scheduler: execute every 30 seconds
@@ -120,6 +287,11 @@ def check_new_sessions():
 
 
 if __name__ == "__main__":
+    dispatcher.start()
+    dispatcher.reap_expired_leases()
+    dispatcher.submit_waiting()  # sessions left waiting by a restart
+    reminders.start()
+    ingestion.resume()
     scheduler.init_app(app)
 
     scheduler.start()
@@ -0,0 +1,190 @@
+"""
+End-to-end benchmark of upload -> parsed session -> first call, against fake OpenAI and Retell clients.
+
+Usage (from backend/):
+    python -m bench.bench_pipeline [--sessions 50] [--concurrency 8] [--upload-latency 0.3] [--output results.json]
+
+Runs in a temporary working directory, so it never touches the real sessions or uploads.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+from PIL import Image
+
+from bench.fakes import FakeOpenAI, FakeRetell, Latency
+
+PARSED_STATUSES = {"new", "queued", "calling", "initial_call_completed", "call_failed"}
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def make_document(i: int, pages: int, as_pdf: bool) -> tuple[bytes, str]:
+    """A unique document (so the parse cache never hits): multi-page PDF, or PNG without poppler."""
+    images = [Image.new("RGB", (1275, 1650), (i % 256, (i // 256) % 256, page)) for page in range(pages)]
+    buf = io.BytesIO()
+    if as_pdf:
+        images[0].save(buf, "PDF", save_all=True, append_images=images[1:])
+        return buf.getvalue(), f"note_{i}.pdf"
+    images[0].save(buf, "PNG")
+    return buf.getvalue(), f"note_{i}.png"
+
+
+def percentiles(samples: list[float]) -> dict[str, float]:
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+    return {
+        "mean_ms": round(statistics.fmean(samples) * 1000, 2),
+        "p50_ms": round(ordered[len(ordered) // 2] * 1000, 2),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 2),
+        "max_ms": round(ordered[-1] * 1000, 2),
+    }
+
+
+def wait_for_status(store: Any, session_id: str, statuses: set[str], timeout: float) -> str:
+    deadline = time.monotonic() + timeout
+    while True:
+        status = store.get(session_id).get("status")
+        if status in statuses or time.monotonic() > deadline:
+            return status
+        time.sleep(0.005)
+
+
+def run(args: argparse.Namespace) -> dict[str, Any]:
+    original_cwd = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix="bench-pipeline-")
+    os.chdir(workdir)
+    sys.path.insert(0, BACKEND_DIR)
+    # Webhook signatures are checked against the Retell key
+    os.environ.setdefault("RETELL_API_KEY", "bench")
+    os.environ["PARSE_CACHE_DIR"] = os.path.join(workdir, "parse_cache")
+
+    import app as backend
+    import parse_doc
+    import initial_call
+
+    fake_openai = FakeOpenAI(
+        upload=Latency(args.upload_latency, args.upload_latency / 4),
+        delete=Latency(args.upload_latency / 2),
+        response=Latency(args.response_latency, args.response_latency / 4),
+        rate_limit=args.openai_rate_limit,
+    )
+
+    client = backend.app.test_client()
+
+    def send_webhook(event: dict[str, Any]) -> None:
+        # Retell retries non-2xx responses; the call may not be registered yet when it ends instantly
+        for _ in range(20):
+            resp = client.post("/api/retell/webhook", json=event, headers={"X-Retell-Signature": "bench"})
+            if resp.status_code == 200:
+                return
+            time.sleep(0.05)
+
+    fake_retell = FakeRetell(
+        create=Latency(args.retell_latency),
+        call=Latency(args.retell_latency),
+        retrieve=Latency(args.retell_latency),
+        call_duration=args.call_duration,
+        on_call_ended=send_webhook,
+    )
+    # The fakes are wrapped in the same rate limiting and retry layer as the real clients
+    parse_doc.client.set(fake_openai)
+    initial_call.client.set(fake_retell)
+
+    as_pdf = shutil.which("pdftoppm") is not None
+    documents = [make_document(i, args.pages, as_pdf) for i in range(args.sessions)]
+    backend.dispatcher.start()
+
+    stages: dict[str, list[float]] = {"upload_response": [], "parsed": [], "dialed": [], "completed": []}
+    failures = 0
+
+    def one_session(i: int) -> None:
+        nonlocal failures
+        data, name = documents[i]
+        start = time.monotonic()
+        resp = client.post("/api/upload", data={"note": (io.BytesIO(data), name)})
+        stages["upload_response"].append(time.monotonic() - start)
+        session_id = resp.get_json()["session_id"]
+
+        # Parsed sessions go to the dispatcher at once, so "new" may already be gone
+        parsed = wait_for_status(backend.store, session_id, PARSED_STATUSES | {"parse_failed"}, args.timeout)
+        if parsed not in PARSED_STATUSES:
+            failures += 1
+            return
+        stages["parsed"].append(time.monotonic() - start)
+
+        # The dispatcher is notified when the session becomes "new"
+        while time.monotonic() - start < args.timeout:
+            sess = backend.store.get(session_id)
+            if sess.get("call_id") or sess.get("status") == "call_failed":
+                break
+            time.sleep(0.005)
+        stages["dialed"].append(time.monotonic() - start)
+
+        final = wait_for_status(backend.store, session_id, {"initial_call_completed", "call_failed"}, args.timeout)
+        if final != "initial_call_completed":
+            failures += 1
+            return
+        stages["completed"].append(time.monotonic() - start)
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(one_session, range(args.sessions)))
+    elapsed = time.monotonic() - start
+
+    # Webhooks run post-call handling (reminders) after the session reads as completed:
+    # let it finish before the working directory goes away
+    fake_retell.shutdown()
+    backend.dispatcher.shutdown(wait=True)
+    backend.reminders.shutdown(wait=True)
+    backend.ingestion.shutdown(wait=True)
+    os.chdir(original_cwd)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "config": {
+            **vars(args),
+            "document": "pdf" if as_pdf else "png",
+        },
+        "sessions_completed": len(stages["completed"]),
+        "failures": failures,
+        "elapsed_seconds": round(elapsed, 3),
+        "sessions_per_second": round(len(stages["completed"]) / elapsed, 3) if elapsed else 0.0,
+        "latency": {stage: percentiles(samples) for stage, samples in stages.items()},
+        "remote_calls": {**fake_openai.calls.counts, **fake_retell.calls.counts},
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="End-to-end pipeline benchmark with fake remote APIs")
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=8, help="uploads in flight at once")
+    parser.add_argument("--pages", type=int, default=3, help="pages per PDF (PNG documents have one)")
+    parser.add_argument("--upload-latency", type=float, default=0.3, help="seconds per files.create")
+    parser.add_argument("--response-latency", type=float, default=2.0, help="seconds per responses.create")
+    parser.add_argument("--openai-rate-limit", type=float, default=0.0,
+                        help="requests per second the fake OpenAI accepts before answering 429 (0: no limit)")
+    parser.add_argument("--retell-latency", type=float, default=0.2, help="seconds per Retell API call")
+    parser.add_argument("--call-duration", type=float, default=1.0, help="seconds until a fake call ends")
+    parser.add_argument("--timeout", type=float, default=120.0, help="max seconds per session stage")
+    parser.add_argument("--output", default=None, help="write JSON results here (default: stdout)")
+    args = parser.parse_args()
+
+    # The backend logs with print(); keep stdout for the results
+    with contextlib.redirect_stdout(sys.stderr):
+        results = run(args)
+    output = json.dumps({"pipeline": results}, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    else:
+        print(output)
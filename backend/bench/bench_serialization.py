@@ -0,0 +1,114 @@
+"""
+Encode/decode benchmark of the file store formats against the old indented JSON file.
+
+Usage (from backend/):
+    python -m bench.bench_serialization [--sizes 1000 10000] [--formats json msgpack] [--blobs] [--output results.json]
+
+Per format and dataset size:
+- encode / decode: the whole store, as on a cold write or read
+- write_one: re-encoding one changed session and joining the cached encodings of the rest (a store write)
+- get_one: decoding a single cached session (a store read)
+"""
+import argparse
+import json
+import sys
+import time
+import uuid
+from typing import Any, Callable
+
+from bench.bench_store import make_session
+from serializers import FORMATS, get_serializer
+
+
+def make_sessions(size: int, blobs: bool) -> dict[str, dict[str, Any]]:
+    sessions = {str(uuid.uuid4()): make_session(i) for i in range(size)}
+    if blobs:
+        # Large texts replaced by blob references, as the blob store writes them
+        for sid, sess in sessions.items():
+            sess["data"]["full_text"] = {"$blob": f"{sid}/data.full_text-0123456789abcdef.txt", "bytes": 3600}
+            sess["call_results"]["transcript"] = {"$blob": f"{sid}/call_results.transcript-0123456789abcdef.txt", "bytes": 3300}
+    return sessions
+
+
+def best_of(fn: Callable[[], Any], repeat: int) -> float:
+    """Fastest of `repeat` runs, in seconds."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def result(fmt: str, size: int, op: str, seconds: float, nbytes: int) -> dict[str, Any]:
+    return {
+        "format": fmt, "sessions": size, "op": op,
+        "ms": round(seconds * 1000, 4),
+        "mb_per_second": round(nbytes / seconds / 1e6, 1) if seconds else 0.0,
+    }
+
+
+def bench_indented_json(sessions: dict[str, dict[str, Any]], repeat: int) -> list[dict[str, Any]]:
+    """The old file store format: the whole map dumped with indent=2 on every write."""
+    size = len(sessions)
+    data = json.dumps(sessions, ensure_ascii=False, indent=2).encode("utf-8")
+    encode = best_of(lambda: json.dumps(sessions, ensure_ascii=False, indent=2).encode("utf-8"), repeat)
+    decode = best_of(lambda: json.loads(data), repeat)
+    return [
+        {"format": "json-indent", "sessions": size, "op": "file_bytes", "bytes": len(data)},
+        result("json-indent", size, "encode", encode, len(data)),
+        result("json-indent", size, "decode", decode, len(data)),
+        # Every write and read used to process the whole file
+        result("json-indent", size, "write_one", encode, len(data)),
+        result("json-indent", size, "get_one", decode, len(data)),
+    ]
+
+
+def bench_format(fmt: str, sessions: dict[str, dict[str, Any]], repeat: int) -> list[dict[str, Any]]:
+    serializer = get_serializer(fmt)
+    size = len(sessions)
+    sid = next(iter(sessions))
+    encoded = {key: serializer.encode(sess) for key, sess in sessions.items()}
+    data = serializer.join(encoded)
+
+    def write_one() -> bytes:
+        encoded[sid] = serializer.encode(sessions[sid])
+        return serializer.join(encoded)
+
+    encode = best_of(lambda: serializer.join({key: serializer.encode(sess) for key, sess in sessions.items()}), repeat)
+    decode = best_of(lambda: serializer.decode(data), repeat)
+    return [
+        {"format": fmt, "sessions": size, "op": "file_bytes", "bytes": len(data)},
+        result(fmt, size, "encode", encode, len(data)),
+        result(fmt, size, "decode", decode, len(data)),
+        result(fmt, size, "write_one", best_of(write_one, repeat), len(data)),
+        result(fmt, size, "get_one", best_of(lambda: serializer.decode(encoded[sid]), repeat), len(encoded[sid])),
+    ]
+
+
+def run(sizes: list[int], formats: list[str], repeat: int, blobs: bool = False) -> list[dict[str, Any]]:
+    results: list[dict[str, Any]] = []
+    for size in sizes:
+        print(f"[Bench] serialization sessions={size} blobs={blobs}", file=sys.stderr)
+        sessions = make_sessions(size, blobs)
+        results.extend(bench_indented_json(sessions, repeat))
+        for fmt in formats:
+            results.extend(bench_format(fmt, sessions, repeat))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="File store serialization benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--formats", nargs="+", choices=FORMATS, default=list(FORMATS))
+    parser.add_argument("--repeat", type=int, default=5, help="runs per measurement (the fastest is reported)")
+    parser.add_argument("--blobs", action="store_true", help="sessions with large texts in side files (blob_store)")
+    parser.add_argument("--output", default=None, help="write JSON results here (default: stdout)")
+    args = parser.parse_args()
+
+    output = json.dumps({"serialization": run(args.sizes, args.formats, args.repeat, args.blobs)}, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    else:
+        print(output)
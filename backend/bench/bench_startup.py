@@ -0,0 +1,75 @@
+"""
+Startup benchmark: time to import backend modules in a fresh interpreter, and which heavy
+dependencies each import pulls in. Runs without API keys, so an import that needs one fails here.
+
+Usage (from backend/):
+    python -m bench.bench_startup [--modules app session_store ...] [--runs 5] [--output results.json]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from typing import Any
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULES = ("session_store", "blob_store", "ingest_cli", "create_session", "call_dispatcher", "app")
+# Dependencies that should only be loaded once a document is parsed or a call is made
+HEAVY = ("openai", "retell", "httpx", "pdf2image", "PIL")
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "loaded": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def import_once(module: str, workdir: str) -> dict[str, Any]:
+    env = {k: v for k, v in os.environ.items() if k not in ("OPENAI_API_KEY", "RETELL_API_KEY")}
+    env["PYTHONPATH"] = BACKEND_DIR
+    proc = subprocess.run(
+        [sys.executable, "-c", PROBE.format(module=module, heavy=HEAVY)],
+        cwd=workdir, env=env, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        return {"error": proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else f"exit {proc.returncode}"}
+    # The backend logs with print(); the probe's result is the last line
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def run(modules: list[str], runs: int) -> dict[str, Any]:
+    results: dict[str, Any] = {}
+    # app opens the session store and upload folder on import; keep them out of the backend directory
+    with tempfile.TemporaryDirectory(prefix="bench-startup-") as workdir:
+        for module in modules:
+            samples = [import_once(module, workdir) for _ in range(runs)]
+            errors = [s["error"] for s in samples if "error" in s]
+            if errors:
+                results[module] = {"error": errors[0]}
+                continue
+            seconds = [s["seconds"] for s in samples]
+            results[module] = {
+                "median_ms": round(statistics.median(seconds) * 1000, 1),
+                "min_ms": round(min(seconds) * 1000, 1),
+                "heavy_imports": samples[0]["loaded"],
+            }
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backend import time benchmark")
+    parser.add_argument("--modules", nargs="+", default=list(MODULES))
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per module")
+    parser.add_argument("--output", default=None, help="write JSON results here (default: stdout)")
+    args = parser.parse_args()
+
+    output = json.dumps({"startup": run(args.modules, args.runs)}, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    else:
+        print(output)
@@ -0,0 +1,144 @@
+"""
+Microbenchmarks of the session store backends at different dataset sizes.
+
+Usage (from backend/):
+    python -m bench.bench_store [--sizes 1000 10000 100000] [--backends file log sqlite] [--blobs]
+                                [--file-format json|msgpack] [--output results.json]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from typing import Any, Callable
+
+from blob_store import BlobStore, externalize
+from session_store import SessionStore, open_store
+
+OPS = ("create", "get", "exists", "update", "get_by_status", "list_page")
+
+
+def make_session(i: int) -> dict[str, Any]:
+    """A session shaped like the ones the backend stores after the first call."""
+    return {
+        "file_path": f"uploaded_notes/note_{i}.pdf",
+        "created_at": 1_700_000_000.0 + i,
+        "data": {
+            "patient_name": f"Patient {i}", "doctor_name": "Dr. Smith", "diagnoses": "Hypertension",
+            "medications": "Lisinopril 10 mg once a day", "recommendations": "Low salt diet",
+            "full_text": "Prescription text. " * 200,
+        },
+        "status": "new" if i % 100 == 0 else "initial_call_completed",
+        "reminders": [],
+        "call_results": {"call_id": f"call-{i}", "transcript": "Agent: Hello.\nUser: Hi. " * 150},
+    }
+
+
+def seed_store(base_dir: str, size: int, blobs: bool = False) -> list[str]:
+    """
+    Writes a sessions_store.json with `size` sessions; every backend imports it on first open.
+    With blobs, the large texts are written to side files first, as the blob store does on write.
+    """
+    ids = [str(uuid.uuid4()) for _ in range(size)]
+    sessions = {sid: make_session(i) for i, sid in enumerate(ids)}
+    if blobs:
+        blob_store = BlobStore(os.path.join(base_dir, "blobs"))
+        sessions = {sid: externalize(blob_store, sid, sess) for sid, sess in sessions.items()}
+    with open(os.path.join(base_dir, "sessions_store.json"), "w", encoding="utf-8") as f:
+        json.dump(sessions, f, ensure_ascii=False)
+    return ids
+
+
+def time_op(fn: Callable[[int], Any], max_ops: int, budget_seconds: float) -> list[float]:
+    """Runs fn(i) up to max_ops times or until the time budget is spent. Returns per-op seconds."""
+    samples: list[float] = []
+    deadline = time.perf_counter() + budget_seconds
+    for i in range(max_ops):
+        start = time.perf_counter()
+        fn(i)
+        samples.append(time.perf_counter() - start)
+        if time.perf_counter() > deadline:
+            break
+    return samples
+
+
+def summarize(samples: list[float]) -> dict[str, float]:
+    ordered = sorted(samples)
+    return {
+        "n": len(samples),
+        "mean_ms": round(statistics.fmean(samples) * 1000, 4),
+        "p50_ms": round(ordered[len(ordered) // 2] * 1000, 4),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 4),
+        "ops_per_second": round(len(samples) / sum(samples), 1) if sum(samples) else 0.0,
+    }
+
+
+def bench_backend(backend: str, size: int, max_ops: int, budget_seconds: float,
+                  blobs: bool = False) -> list[dict[str, Any]]:
+    """Benchmarks every store operation of one backend at one dataset size."""
+    with tempfile.TemporaryDirectory(prefix=f"bench-{backend}-") as base_dir:
+        ids = seed_store(base_dir, size, blobs)
+        start = time.perf_counter()
+        store: SessionStore = open_store(backend, base_dir=base_dir, instrument=False, blobs=blobs)
+        open_seconds = time.perf_counter() - start
+
+        ops: dict[str, Callable[[int], Any]] = {
+            "create": lambda i: store.create(make_session(size + i)),
+            "get": lambda i: store.get(ids[i % size]),
+            "exists": lambda i: store.exists(ids[i % size]),
+            "update": lambda i: store.update(ids[i % size], {"status": "calling"}),
+            "get_by_status": lambda i: store.get_by_status("new"),
+            # Second dashboard page of completed sessions
+            "list_page": lambda i: store.list_sessions(
+                "initial_call_completed", cursor=(1_700_000_000.0 + size - 50, ""), limit=50
+            ),
+        }
+        results = [{
+            "backend": backend, "blobs": blobs, "sessions": size, "op": "open",
+            **summarize([open_seconds]),
+        }]
+        for op in OPS:
+            results.append({
+                "backend": backend, "blobs": blobs, "sessions": size, "op": op,
+                **summarize(time_op(ops[op], max_ops, budget_seconds)),
+            })
+
+        close = getattr(store, "close", None)
+        if close is not None:
+            close()
+        return results
+
+
+def run(sizes: list[int], backends: list[str], max_ops: int, budget_seconds: float,
+        blobs: bool = False) -> list[dict[str, Any]]:
+    results: list[dict[str, Any]] = []
+    for size in sizes:
+        for backend in backends:
+            print(f"[Bench] store={backend} sessions={size} blobs={blobs}", file=sys.stderr)
+            results.extend(bench_backend(backend, size, max_ops, budget_seconds, blobs))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Session store microbenchmarks")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--backends", nargs="+", default=["file", "log", "sqlite"])
+    parser.add_argument("--ops", type=int, default=200, help="max operations per measurement")
+    parser.add_argument("--budget", type=float, default=5.0, help="max seconds per measurement")
+    parser.add_argument("--blobs", action="store_true", help="keep large texts in side files (blob_store)")
+    parser.add_argument("--file-format", choices=("json", "msgpack"), default=None,
+                        help="encoding of the file backend (default: SESSION_FILE_FORMAT, then json)")
+    parser.add_argument("--output", default=None, help="write JSON results here (default: stdout)")
+    args = parser.parse_args()
+    if args.file_format:
+        os.environ["SESSION_FILE_FORMAT"] = args.file_format
+
+    output = json.dumps({"store": run(args.sizes, args.backends, args.ops, args.budget, args.blobs)}, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    else:
+        print(output)
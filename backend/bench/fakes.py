@@ -0,0 +1,196 @@
+"""
+In-process stand-ins for the OpenAI and Retell clients, with configurable latency.
+They implement only the calls the backend makes, and return objects shaped like the SDK's.
+"""
+import itertools
+import json
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from types import SimpleNamespace
+from typing import Any, Callable
+
+
+@dataclass
+class Latency:
+    """Simulated latency of one remote call: mean +/- jitter seconds."""
+    mean: float = 0.0
+    jitter: float = 0.0
+
+    def sleep(self) -> None:
+        delay = self.mean + random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+
+@dataclass
+class CallCounter:
+    """Counts calls per endpoint, thread-safe."""
+    counts: dict[str, int] = field(default_factory=dict)
+    _lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def hit(self, endpoint: str) -> None:
+        with self._lock:
+            self.counts[endpoint] = self.counts.get(endpoint, 0) + 1
+
+
+class FakeStatusError(Exception):
+    """Shaped like the SDKs' APIStatusError: status_code and a response with headers."""
+
+    def __init__(self, status_code: int, headers: dict[str, str] | None = None):
+        super().__init__(f"Error code: {status_code}")
+        self.status_code = status_code
+        self.response = SimpleNamespace(headers=headers or {})
+
+
+class ServerRateLimit:
+    """Server-side request limit: requests over `rate` per second are answered with 429 (rate <= 0: none)."""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self._allowance = max(1.0, rate)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def check(self) -> None:
+        if self.rate <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._allowance = min(max(1.0, self.rate), self._allowance + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._allowance < 1:
+                retry_after = (1 - self._allowance) / self.rate
+                raise FakeStatusError(429, {"retry-after-ms": str(int(retry_after * 1000) + 1)})
+            self._allowance -= 1
+
+
+class FakeOpenAI:
+    """
+    Fake of the OpenAI client: files.create/delete and responses.create.
+    With rate_limit, uploads and responses over that many requests per second get 429 errors.
+    """
+
+    def __init__(self, upload: Latency | None = None, delete: Latency | None = None,
+                 response: Latency | None = None, result: dict[str, Any] | None = None,
+                 rate_limit: float = 0.0):
+        self.calls = CallCounter()
+        self._limit = ServerRateLimit(rate_limit)
+        self._ids = itertools.count(1)
+        self._upload = upload or Latency()
+        self._delete = delete or Latency()
+        self._response = response or Latency()
+        self._result = result or {
+            "patient_name": "Jane Doe", "doctor_name": "Dr. Smith", "diagnoses": "Hypertension",
+            "medications": "Lisinopril 10 mg once a day", "recommendations": "Low salt diet",
+            "full_text": "Prescription. " * 200,
+        }
+        self.files = SimpleNamespace(create=self._files_create, delete=self._files_delete)
+        self.responses = SimpleNamespace(create=self._responses_create)
+
+    def _files_create(self, file: Any, purpose: str) -> Any:
+        self._check_limit("files.create")
+        self.calls.hit("files.create")
+        self._upload.sleep()
+        return SimpleNamespace(id=f"file-{next(self._ids)}", purpose=purpose)
+
+    def _files_delete(self, file_id: str) -> Any:
+        self.calls.hit("files.delete")
+        self._delete.sleep()
+        return SimpleNamespace(id=file_id, deleted=True)
+
+    def _responses_create(self, **kwargs: Any) -> Any:
+        self._check_limit("responses.create")
+        self.calls.hit("responses.create")
+        self._response.sleep()
+        return SimpleNamespace(output_text=json.dumps(self._result))
+
+    def _check_limit(self, endpoint: str) -> None:
+        try:
+            self._limit.check()
+        except FakeStatusError:
+            self.calls.hit(f"{endpoint}:429")
+            raise
+
+
+class FakeRetell:
+    """
+    Fake of the Retell client: llm/agent creation and phone calls.
+    A call reports "ongoing" until call_duration seconds after it was created, then "ended".
+    If on_call_ended is set, it is called with a call_ended event at that moment, like Retell's webhook.
+    """
+
+    def __init__(self, create: Latency | None = None, call: Latency | None = None,
+                 retrieve: Latency | None = None, call_duration: float = 0.0,
+                 call_schedules: str = "not required",
+                 on_call_ended: Callable[[dict[str, Any]], None] | None = None):
+        self.calls = CallCounter()
+        self._ids = itertools.count(1)
+        self._create = create or Latency()
+        self._call = call or Latency()
+        self._retrieve = retrieve or Latency()
+        self.call_duration = call_duration
+        self.call_schedules = call_schedules
+        self.on_call_ended = on_call_ended
+        self._started: dict[str, float] = {}
+        self._timers: list[threading.Timer] = []
+        self._lock = threading.Lock()
+        self.llm = SimpleNamespace(create=self._llm_create)
+        self.agent = SimpleNamespace(create=self._agent_create)
+        self.call = SimpleNamespace(create_phone_call=self._create_phone_call, retrieve=self._retrieve_call)
+
+    def shutdown(self) -> None:
+        """Cancels pending call_ended events and waits for the ones being delivered."""
+        with self._lock:
+            timers, self._timers = self._timers, []
+        for timer in timers:
+            timer.cancel()
+        for timer in timers:
+            timer.join()
+
+    def verify(self, body: str, api_key: str, signature: str) -> bool:
+        return True
+
+    def call_payload(self, call_id: str, status: str = "ended") -> dict[str, Any]:
+        """The call object as Retell sends it in call_ended webhooks."""
+        return {
+            "call_id": call_id,
+            "call_status": status,
+            "transcript": "Agent: Hello Jane.\nUser: Hi.",
+            "disconnection_reason": "user_hangup",
+            "collected_dynamic_variables": {"callSchedules": self.call_schedules},
+        }
+
+    def _llm_create(self, **kwargs: Any) -> Any:
+        self.calls.hit("llm.create")
+        self._create.sleep()
+        return SimpleNamespace(llm_id=f"llm-{next(self._ids)}")
+
+    def _agent_create(self, **kwargs: Any) -> Any:
+        self.calls.hit("agent.create")
+        self._create.sleep()
+        return SimpleNamespace(agent_id=f"agent-{next(self._ids)}")
+
+    def _create_phone_call(self, **kwargs: Any) -> Any:
+        self.calls.hit("call.create_phone_call")
+        self._call.sleep()
+        call_id = f"call-{next(self._ids)}"
+        with self._lock:
+            self._started[call_id] = time.monotonic()
+        if self.on_call_ended is not None:
+            event = {"event": "call_ended", "call": self.call_payload(call_id)}
+            timer = threading.Timer(self.call_duration, self.on_call_ended, args=(event,))
+            timer.daemon = True
+            with self._lock:
+                self._timers.append(timer)
+            timer.start()
+        return SimpleNamespace(call_id=call_id, call_status="registered")
+
+    def _retrieve_call(self, call_id: str) -> Any:
+        self.calls.hit("call.retrieve")
+        self._retrieve.sleep()
+        with self._lock:
+            started = self._started[call_id]
+        status = "ended" if time.monotonic() - started >= self.call_duration else "ongoing"
+        return SimpleNamespace(**self.call_payload(call_id, status))
@@ -0,0 +1,193 @@
+import copy
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Tuple
+
+from session_store import SessionStore, Cursor
+
+# (top-level key, nested key) of large text fields kept out of the session index
+BLOB_FIELDS = (("data", "full_text"), ("call_results", "transcript"))
+# Finished sessions that can be archived once they are older than the retention window
+ARCHIVABLE_STATUSES = ("initial_call_completed", "call_failed")
+
+
+def is_blob_ref(value: Any) -> bool:
+    return isinstance(value, dict) and "$blob" in value
+
+
+class BlobStore:
+    """
+    Per-session side files for large text fields: blobs/<session_id>/<name>-<sha256 prefix>.txt
+    Names include the content hash, so a rewrite never changes a blob that a stored session refers to.
+    """
+
+    def __init__(self, base_dir: str):
+        self.base_dir = Path(base_dir)
+        self.base_dir.mkdir(parents=True, exist_ok=True)
+
+    def put(self, session_id: str, name: str, text: str) -> Dict[str, Any]:
+        """Writes a blob and returns the reference stored in its place."""
+        data = text.encode("utf-8")
+        rel_path = f"{session_id}/{name}-{hashlib.sha256(data).hexdigest()[:16]}.txt"
+        path = self.base_dir / rel_path
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(f".{uuid.uuid4().hex}.tmp")
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        return {"$blob": rel_path, "bytes": len(data)}
+
+    def get(self, ref: Dict[str, Any]) -> str:
+        with open(self.base_dir / ref["$blob"], "r", encoding="utf-8") as f:
+            return f.read()
+
+    def delete_session(self, session_id: str) -> None:
+        shutil.rmtree(self.base_dir / session_id, ignore_errors=True)
+
+
+class BlobSessionStore:
+    """
+    Keeps the session index small: large text fields (BLOB_FIELDS) are written to a BlobStore
+    and replaced by {"$blob": path, "bytes": n} references. get() returns the references;
+    load_blobs() reads them back when the text is actually needed.
+    Finished sessions older than a retention window can be archived to one JSON file each
+    (blobs inlined); get() still finds them there.
+    - min_bytes: texts shorter than this stay inline
+    """
+
+    def __init__(self, store: SessionStore, base_dir: str = "sessions", min_bytes: int = 1024):
+        self._store = store
+        self.blobs = BlobStore(os.path.join(base_dir, "blobs"))
+        self.archive_dir = Path(base_dir) / "archive"
+        self.min_bytes = min_bytes
+
+    def create(self, initial: Dict[str, Any], session_id: Optional[str] = None) -> str:
+        sid = session_id or str(uuid.uuid4())
+        return self._store.create(self._externalize(sid, initial), session_id=sid)
+
+    def get(self, session_id: str) -> Dict[str, Any]:
+        """Returns the session with blob references; archived sessions are read from the archive."""
+        try:
+            return self._store.get(session_id)
+        except FileNotFoundError:
+            archived = self._read_archive(session_id)
+            if archived is None:
+                raise
+            return archived
+
+    def get_by_status(self, status: str) -> Dict[str, Any]:
+        return self._store.get_by_status(status)
+
+    def set(self, session_id: str, data: Dict[str, Any]) -> None:
+        self._store.set(session_id, self._externalize(session_id, data))
+
+    def update(self, session_id: str, patch: Dict[str, Any]) -> Dict[str, Any]:
+        return self._store.update(session_id, self._externalize(session_id, patch))
+
+    def compare_and_update(
+        self, session_id: str, expected: Dict[str, Any], patch: Dict[str, Any]
+    ) -> Optional[Dict[str, Any]]:
+        return self._store.compare_and_update(session_id, expected, self._externalize(session_id, patch))
+
+    def exists(self, session_id: str) -> bool:
+        return self._store.exists(session_id) or (self.archive_dir / f"{session_id}.json").exists()
+
+    def delete(self, session_id: str) -> None:
+        self._store.delete(session_id)
+        self.blobs.delete_session(session_id)
+        (self.archive_dir / f"{session_id}.json").unlink(missing_ok=True)
+
+    def list_sessions(
+        self,
+        status: Optional[str] = None,
+        created_after: Optional[float] = None,
+        created_before: Optional[float] = None,
+        cursor: Optional[Cursor] = None,
+        limit: int = 50,
+    ) -> List[Tuple[str, Dict[str, Any]]]:
+        return self._store.list_sessions(status, created_after, created_before, cursor, limit)
+
+    def load_blobs(self, value: Any) -> Any:
+        """Returns a copy of a session (or part of one) with blob references replaced by their text."""
+        if is_blob_ref(value):
+            return self.blobs.get(value)
+        if isinstance(value, dict):
+            return {key: self.load_blobs(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [self.load_blobs(item) for item in value]
+        return value
+
+    def archive_completed(self, older_than_seconds: float) -> int:
+        """
+        Moves finished sessions whose completed_at is older than the window, and that have
+        no upcoming reminders, out of the index into archive/<session_id>.json.
+        Returns the number of sessions archived.
+        """
+        self.archive_dir.mkdir(parents=True, exist_ok=True)
+        cutoff = time.time() - older_than_seconds
+        archived = 0
+        for status in ARCHIVABLE_STATUSES:
+            for session_id, sess in self._store.get_by_status(status).items():
+                if not sess.get("completed_at") or sess["completed_at"] > cutoff:
+                    continue
+                if any(r.get("next_fire_at") for r in sess.get("reminders") or []):
+                    continue
+                path = self.archive_dir / f"{session_id}.json"
+                tmp = path.with_suffix(".tmp")
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump({**self.load_blobs(sess), "archived_at": time.time()}, f, ensure_ascii=False)
+                os.replace(tmp, path)
+                # Only drop it from the index if it did not change while being archived
+                expected = {"status": status, "completed_at": sess["completed_at"], "reminders": sess.get("reminders")}
+                if self._store.compare_and_update(session_id, expected, {"status": "archived"}) is None:
+                    path.unlink(missing_ok=True)
+                    continue
+                self._store.delete(session_id)
+                self.blobs.delete_session(session_id)
+                archived += 1
+        if archived:
+            print(f"[Store] Archived {archived} finished session(s)")
+        return archived
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._store, name)
+
+    # --- internal ---
+
+    def _externalize(self, session_id: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        return externalize(self.blobs, session_id, data, self.min_bytes)
+
+    def _read_archive(self, session_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self.archive_dir / f"{session_id}.json", "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+
+def externalize(blobs: BlobStore, session_id: str, data: Dict[str, Any], min_bytes: int = 1024) -> Dict[str, Any]:
+    """Returns session data (or a patch) with large BLOB_FIELDS texts written to blobs and replaced by references."""
+    result = data
+    for parent, field in BLOB_FIELDS:
+        section = data.get(parent)
+        if not isinstance(section, dict):
+            continue
+        text = section.get(field)
+        if not isinstance(text, str) or len(text) < min_bytes:
+            continue
+        if result is data:
+            result = copy.copy(data)
+        result[parent] = {**section, field: blobs.put(session_id, f"{parent}.{field}", text)}
+    return result
+
+
+def load_blobs(store: SessionStore, value: Any) -> Any:
+    """Resolves blob references in a value read from store (a no-op for stores without blobs)."""
+    loader = getattr(store, "load_blobs", None)
+    return loader(value) if loader is not None else value
@@ -0,0 +1,376 @@
+import os
+import queue
+import socket
+import threading
+import time
+from typing import Any, Callable, Optional
+
+import metrics
+from session_store import SessionStore
+from blob_store import load_blobs
+from initial_call import make_patient_call, get_call_details, FINISHED_CALL_STATUSES
+
+CALLS_FINISHED = metrics.counter("calls_finished_total", "Finished first calls by outcome", ("outcome",))
+CALL_DURATION_SECONDS = metrics.histogram("call_duration_seconds", "Time from dialing to the call result being stored")
+
+
+class CallDispatcher:
+    """
+    Places first calls for new sessions from a bounded queue, holding a call slot per call in progress.
+    - max_concurrent_calls: number of outbound calls that can be in progress at once
+    - max_queue_size: number of sessions waiting for a free call slot
+    - call_timeout_seconds: calls still running after this long are marked failed by the sweep
+    - on_call_completed: called with the session id after a first call's results are stored
+    - worker_id: identifies this dispatcher in session leases (defaults to host and pid)
+    - lease_seconds: how long a claim on a session lasts without a heartbeat
+
+    Session status transitions: new -> queued -> calling -> initial_call_completed | call_failed
+    (then "needs_review" if the reminder scheduler cannot understand a spoken medication time).
+    Sessions are claimed with compare-and-set, recording lease_owner and lease_expires_at, so
+    several dispatcher processes can share a store. Leases of queued and calling sessions are
+    renewed by a heartbeat; reap_expired_leases() returns sessions of dead workers to "new".
+    New sessions arrive through notify(), which wakes the dispatcher right away. When the queue
+    is full, submit() refuses the session and it stays "new"; once a worker frees queue space the
+    dispatcher rescans for waiting sessions, and submit_waiting() is also run as a slow recovery sweep.
+    Workers only place the call; it is finished by complete_call(), driven by the call_ended
+    webhook, with sweep_active_calls() as a slow polling fallback for missed events.
+    """
+
+    def __init__(
+        self,
+        store: SessionStore,
+        max_concurrent_calls: int = 4,
+        max_queue_size: int = 100,
+        call_timeout_seconds: float = 3600,
+        on_call_completed: Optional[Callable[[str], Any]] = None,
+        worker_id: Optional[str] = None,
+        lease_seconds: float = 120,
+    ):
+        self.store = store
+        self.max_concurrent_calls = max_concurrent_calls
+        self.call_timeout_seconds = call_timeout_seconds
+        self.on_call_completed = on_call_completed
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.lease_seconds = lease_seconds
+        self._stop = threading.Event()
+        self._queue: queue.Queue[Optional[str]] = queue.Queue(maxsize=max_queue_size)
+        self._pending: set[str] = set()  # sessions queued or being dialed
+        self._pending_lock = threading.Lock()
+        self._slots = threading.Semaphore(max_concurrent_calls)
+        self._active_calls: dict[str, str] = {}  # call_id -> session_id, each holding a slot
+        self._calls_lock = threading.Lock()
+        self._workers: list[threading.Thread] = []
+        # Session ids from notify(), or _RESCAN to look for sessions left waiting in the store
+        self._notifications: queue.SimpleQueue[Optional[str]] = queue.SimpleQueue()
+        self._overflowed = False  # a session was refused because the queue was full
+
+    def start(self) -> None:
+        for i in range(self.max_concurrent_calls):
+            worker = threading.Thread(target=self._worker_loop, name=f"call-worker-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+        listener = threading.Thread(target=self._notification_loop, name="call-dispatcher", daemon=True)
+        listener.start()
+        self._workers.append(listener)
+        heartbeat = threading.Thread(target=self._heartbeat_loop, name="call-lease-heartbeat", daemon=True)
+        heartbeat.start()
+        self._workers.append(heartbeat)
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Stops the workers once they are done with the sessions they picked up."""
+        self._stop.set()
+        self._notifications.put(None)
+        for _ in range(self.max_concurrent_calls):
+            self._queue.put(None)
+            self._slots.release()  # wake workers waiting for a slot
+        if wait:
+            for worker in self._workers:
+                worker.join()
+        self._workers = []
+
+    def submit(self, session_id: str) -> bool:
+        """
+        Queues the first call for a session.
+        Returns False if the queue is full, so the caller can retry later.
+        Sessions that are already queued, or no longer "new" (e.g. claimed by another worker),
+        are accepted without queueing them.
+        """
+        with self._pending_lock:
+            if session_id in self._pending:
+                return True
+            if self._queue.full():
+                self._overflowed = True
+                return False
+            # Claim before queueing, so a worker's "calling" is never overwritten by "queued"
+            claimed = self.store.compare_and_update(
+                session_id, {'status': 'new'}, {'status': 'queued', **self._lease()}
+            )
+            if claimed is None:
+                return True
+            self._pending.add(session_id)
+            self._queue.put_nowait(session_id)
+        return True
+
+    def notify(self, session_id: str) -> None:
+        """Signals that a session became "new". Never blocks; the call is queued from the dispatcher thread."""
+        self._notifications.put(session_id)
+
+    def submit_waiting(self) -> int:
+        """
+        Queues "new" sessions waiting in the store (queued ones of dead workers become "new" through
+        reap_expired_leases). Stops at the first refusal, when the queue is full.
+        Returns the number of sessions queued.
+        """
+        submitted = 0
+        for session_id in self.store.get_by_status('new'):
+            if self.is_pending(session_id):
+                continue
+            if not self.submit(session_id):
+                print("[Dispatcher] Call queue is full, the rest waits for free space")
+                break
+            submitted += 1
+            print(f"[Dispatcher] New session {session_id}, queued first call.")
+        return submitted
+
+    def is_pending(self, session_id: str) -> bool:
+        with self._pending_lock:
+            return session_id in self._pending
+
+    def complete_call(self, call_id: str, final_call_details: Any) -> Optional[str]:
+        """
+        Finishes a call: stores its results and frees its call slot.
+        - final_call_details: call object from Retell (webhook payload dict or SDK model), None if failed
+        Returns the session id, or None if no calling session has this call_id.
+        Repeated events for the same call are ignored.
+        """
+        with self._calls_lock:
+            session_id = self._active_calls.pop(call_id, None)
+            if session_id is not None:
+                self._slots.release()
+        if session_id is None:
+            # The call was placed before a restart
+            session_id = self._find_calling_session(call_id)
+            if session_id is None:
+                return None
+
+        sess = self.store.get(session_id)
+        if sess.get('status') != 'calling':
+            return session_id
+        if not finalize_call(self.store, session_id, call_id, final_call_details):
+            return session_id  # finished concurrently by another worker
+        if sess.get('call_started_at'):
+            CALL_DURATION_SECONDS.observe(time.time() - sess['call_started_at'])
+        if final_call_details and self.on_call_completed is not None:
+            try:
+                self.on_call_completed(session_id)
+            except Exception as e:
+                print(f"[Dispatcher] Post-call handling for session {session_id} failed: {e}")
+        return session_id
+
+    def sweep_active_calls(self) -> None:
+        """
+        Fallback for missed webhooks: checks every calling session once
+        and finishes calls that ended or ran past call_timeout_seconds.
+        """
+        for session_id, sess in self.store.get_by_status('calling').items():
+            call_id = sess.get('call_id')
+            if not call_id:
+                continue
+            call_details = get_call_details(call_id)
+            if call_details is not None and call_details.call_status in FINISHED_CALL_STATUSES:
+                print(f"[Sweep] Call {call_id} finished without a webhook event")
+                self.complete_call(call_id, call_details)
+            elif time.time() - sess.get('call_started_at', 0) > self.call_timeout_seconds:
+                print(f"[Sweep] Call {call_id} timed out")
+                self.complete_call(call_id, None)
+
+    def renew_leases(self) -> None:
+        """Heartbeat: extends the leases this worker holds, and frees slots of calls finished elsewhere."""
+        with self._pending_lock:
+            pending = list(self._pending)
+        with self._calls_lock:
+            active = list(self._active_calls.items())
+        for session_id in pending:
+            self._renew(session_id, {'lease_owner': self.worker_id})
+        for call_id, session_id in active:
+            expected = {'lease_owner': self.worker_id, 'status': 'calling', 'call_id': call_id}
+            if self._renew(session_id, expected) is None:
+                # The webhook was handled by another worker, or the lease was lost
+                with self._calls_lock:
+                    if self._active_calls.pop(call_id, None) is not None:
+                        self._slots.release()
+
+    def reap_expired_leases(self) -> int:
+        """
+        Recovers sessions whose worker stopped renewing its lease: queued sessions and calls that
+        were never placed go back to "new". Placed calls only lose the lease; the webhook or
+        sweep_active_calls still finishes them. Returns the number of sessions recovered.
+        """
+        reaped = 0
+        now = time.time()
+        for status in ('queued', 'calling'):
+            for session_id, sess in self.store.get_by_status(status).items():
+                if (sess.get('lease_expires_at') or 0) > now:
+                    continue
+                if status == 'calling' and sess.get('call_id'):
+                    if sess.get('lease_owner') is None:
+                        continue
+                    patch: dict[str, Any] = {'lease_owner': None, 'lease_expires_at': None}
+                else:
+                    patch = {'status': 'new', 'lease_owner': None, 'lease_expires_at': None}
+                expected = {k: sess.get(k) for k in ('status', 'lease_owner', 'lease_expires_at')}
+                if self.store.compare_and_update(session_id, expected, patch) is None:
+                    continue  # renewed or claimed in the meantime
+                reaped += 1
+                print(f"[Dispatcher] Lease of {sess.get('lease_owner')} on session {session_id} expired")
+                if 'status' in patch:
+                    self.notify(session_id)
+        return reaped
+
+    def stats(self) -> dict[str, int]:
+        with self._calls_lock:
+            active = len(self._active_calls)
+        return {'queued': self._queue.qsize(), 'active_calls': active, 'slots': self.max_concurrent_calls}
+
+    # --- internal ---
+
+    def _notification_loop(self) -> None:
+        while True:
+            session_id = self._notifications.get()
+            if session_id is None:
+                return
+            try:
+                if session_id == _RESCAN:
+                    self.submit_waiting()
+                elif self.submit(session_id):
+                    print(f"[Dispatcher] New session {session_id}, queued first call.")
+                else:
+                    print(f"[Dispatcher] Call queue is full, session {session_id} waits for free space")
+            except Exception as e:
+                print(f"[Dispatcher] Could not queue session {session_id}: {e}")
+
+    def _heartbeat_loop(self) -> None:
+        while not self._stop.wait(self.lease_seconds / 3):
+            try:
+                self.renew_leases()
+            except Exception as e:
+                print(f"[Dispatcher] Lease heartbeat failed: {e}")
+
+    def _lease(self) -> dict[str, Any]:
+        return {'lease_owner': self.worker_id, 'lease_expires_at': time.time() + self.lease_seconds}
+
+    def _renew(self, session_id: str, expected: dict[str, Any]) -> Optional[dict[str, Any]]:
+        try:
+            return self.store.compare_and_update(session_id, expected, self._lease())
+        except FileNotFoundError:
+            return None
+
+    def _worker_loop(self) -> None:
+        while True:
+            session_id = self._queue.get()
+            if session_id is None:
+                return
+            with self._pending_lock:
+                rescan, self._overflowed = self._overflowed, False
+            if rescan:
+                # There is queue space again for sessions refused earlier
+                self._notifications.put(_RESCAN)
+            self._slots.acquire()
+            try:
+                call_id = start_first_call(self.store, session_id, self._lease())
+                if call_id is None:
+                    self._slots.release()
+                    print(f"[Dispatcher] Lost the lease on session {session_id}, not calling")
+                    continue
+                with self._calls_lock:
+                    self._active_calls[call_id] = session_id
+            except Exception as e:
+                self._slots.release()
+                print(f"[Dispatcher] Call for session {session_id} failed: {e}")
+                self.store.compare_and_update(
+                    session_id, {'lease_owner': self.worker_id},
+                    {'status': 'call_failed', 'lease_owner': None, 'lease_expires_at': None},
+                )
+            finally:
+                with self._pending_lock:
+                    self._pending.discard(session_id)
+
+    def _find_calling_session(self, call_id: str) -> Optional[str]:
+        for session_id, sess in self.store.get_by_status('calling').items():
+            if sess.get('call_id') == call_id:
+                return session_id
+        return None
+
+
+_RESCAN = "__rescan__"
+
+
+def start_first_call(store: SessionStore, session_id: str, lease: dict[str, Any]) -> Optional[str]:
+    """
+    Moves a queued session to "calling" and places its first call.
+    - lease: {"lease_owner", "lease_expires_at"} of the worker that queued the session
+    Returns the call_id, or None if the session is no longer queued under that owner.
+    """
+    sess = store.compare_and_update(
+        session_id, {'status': 'queued', 'lease_owner': lease['lease_owner']}, {'status': 'calling', **lease}
+    )
+    if sess is None:
+        return None
+    print(f"[Scheduler] Starting first call for session {session_id}")
+    phone_call = make_patient_call(load_blobs(store, sess["data"]))
+    store.update(session_id, {'call_id': phone_call.call_id, 'call_started_at': time.time()})
+    return phone_call.call_id
+
+
+def _call_field(call_details: Any, name: str) -> Any:
+    """Reads a field from a webhook payload dict or a Retell SDK call object."""
+    if isinstance(call_details, dict):
+        return call_details.get(name)
+    return getattr(call_details, name, None)
+
+
+def finalize_call(store: SessionStore, session_id: str, call_id: str, final_call_details: Any) -> bool:
+    """
+    Stores the outcome of a finished call (None means the call timed out or failed) and releases its lease.
+    Returns False if the session was no longer calling with this call_id, e.g. finished by another worker.
+    """
+    expected = {'status': 'calling', 'call_id': call_id}
+    finished = {'lease_owner': None, 'lease_expires_at': None, 'completed_at': time.time()}
+    if not final_call_details:
+        # Handle timeout or error
+        if store.compare_and_update(session_id, expected, {'status': 'call_failed', **finished}) is None:
+            return False
+        CALLS_FINISHED.inc(outcome='failed')
+        print(f"[Scheduler] Call failed or timed out for session {session_id}")
+        return True
+
+    # Extract any collected data from the call
+    collected_data = _call_field(final_call_details, 'collected_dynamic_variables') or {}
+    transcript = _call_field(final_call_details, 'transcript') or ""
+
+    patch: dict[str, Any] = {
+        **finished,
+        'status': 'initial_call_completed',
+        'call_results': {
+            'call_id': call_id,
+            'transcript': transcript,
+            'collected_data': collected_data,
+            'call_status': _call_field(final_call_details, 'call_status'),
+            'disconnection_reason': _call_field(final_call_details, 'disconnection_reason')
+        }
+    }
+
+    if collected_data:
+        # Get the medication reminder preferences
+        call_schedules = collected_data.get('callSchedules')
+        if call_schedules == "not required":
+            print("Patient doesn't want medication reminders")
+        else:
+            print(f"Medication reminders needed: {call_schedules}")
+        patch['callSchedules'] = call_schedules
+
+    if store.compare_and_update(session_id, expected, patch) is None:
+        return False
+    CALLS_FINISHED.inc(outcome='completed')
+    print(f"[Scheduler] Call completed, results stored for session {session_id}")
+    return True
@@ -1,22 +1,94 @@
+import time
 import uuid
-from typing import Any
-from file_store import FileSessionStore
-from parse_doc import parse_doc
+from typing import Any, Callable
+import metrics
+from session_store import SessionStore
+from parse_doc import parse_doc, get_cached_parse
 
+SESSION_STEP_SECONDS = metrics.histogram(
+    "create_session_seconds", "Time per session creation step: create, parse", ("step",)
+)
 
-def create_session(file_path: str, store: FileSessionStore) -> str:
-    """Creates a new session for the uploaded note."""
+# Called with the session id when a session becomes "new" (ready for its first call)
+_ready_listeners: list[Callable[[str], Any]] = []
+
+
+def on_session_ready(listener: Callable[[str], Any]) -> None:
+    """Registers a listener for sessions that became ready for their first call. It must not block."""
+    _ready_listeners.append(listener)
+
+
+def _notify_ready(session_id: str) -> None:
+    for listener in _ready_listeners:
+        try:
+            listener(session_id)
+        except Exception as e:
+            print(f"[Ingestion] Ready listener failed for session {session_id}: {e}")
+
+
+def create_session(
+    file_path: str, store: SessionStore, session_id: str | None = None, file_info: dict[str, Any] | None = None
+) -> str:
+    """Creates a new session for the uploaded note (file_info: see create_pending_session)."""
+    session_id = create_pending_session(file_path, store, session_id=session_id, file_info=file_info)
+    parse_session(session_id, store)
+    return session_id
+
+
+@SESSION_STEP_SECONDS.time(step="create")
+def create_pending_session(
+    file_path: str, store: SessionStore, session_id: str | None = None, file_info: dict[str, Any] | None = None
+) -> str:
+    """
+    Creates a session in the "parsing" state; parse_session fills in its data later.
+    - file_info: upload details stored with the session (file_sha256, file_size, original_filename)
+    """
     # Generating ID
-    session_id = str(uuid.uuid4())
+    session_id = session_id or str(uuid.uuid4())
     initial: dict[str, Any] = {
         "file_path": file_path,
         "data": None,
-        "status": "new",
-        "reminders": []
+        "status": "parsing",
+        "created_at": time.time(),
+        "reminders": [],
+        **(file_info or {}),
     }
-
-    parsed_data = parse_doc([file_path])
-    initial['data'] = parsed_data
-
     store.create(initial, session_id=session_id)
     return session_id
+
+
+@SESSION_STEP_SECONDS.time(step="parse")
+def parse_session(session_id: str, store: SessionStore) -> None:
+    """
+    Parses the session's document and moves it to "new" (ready for the first call),
+    or to "parse_failed" with the error message (the error is re-raised).
+    """
+    sess = store.get(session_id)
+    file_path = sess["file_path"]
+    try:
+        parsed_data = parse_doc([file_path], file_hashes=_file_hashes(sess))
+    except Exception as e:
+        print(f"[Ingestion] Failed to parse {file_path} for session {session_id}: {e}")
+        store.update(session_id, {"status": "parse_failed", "error": str(e)})
+        raise
+    store.update(session_id, {"data": parsed_data, "status": "new"})
+    _notify_ready(session_id)
+
+
+def try_cached_session(session_id: str, store: SessionStore) -> bool:
+    """
+    Completes a "parsing" session from the parse cache, without rendering or uploading anything.
+    Returns False if the document has not been parsed before.
+    """
+    sess = store.get(session_id)
+    parsed_data = get_cached_parse([sess["file_path"]], file_hashes=_file_hashes(sess))
+    if parsed_data is None:
+        return False
+    store.update(session_id, {"data": parsed_data, "status": "new"})
+    _notify_ready(session_id)
+    return True
+
+
+def _file_hashes(sess: dict[str, Any]) -> list[str] | None:
+    """The document hash recorded on upload, if any (older sessions have none)."""
+    return [sess["file_sha256"]] if sess.get("file_sha256") else None
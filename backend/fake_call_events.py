@@ -0,0 +1,56 @@
+"""
+Sends a signed Retell-style call event to a locally running backend.
+
+Usage:
+    RETELL_API_KEY=... python fake_call_events.py <call_id> [--status ended] [--schedules "not required"]
+"""
+import argparse
+import json
+import os
+import urllib.error
+import urllib.request
+
+from retell.lib.webhook_auth import symmetric  # type: ignore
+
+
+def build_event(call_id: str, status: str, schedules: str | None, transcript: str) -> dict:
+    """Builds a call_ended event shaped like the ones Retell posts."""
+    call: dict = {
+        "call_id": call_id,
+        "call_status": status,
+        "transcript": transcript,
+        "disconnection_reason": "user_hangup" if status == "ended" else "dial_failed",
+        "collected_dynamic_variables": {"callSchedules": schedules} if schedules else {},
+    }
+    return {"event": "call_ended", "call": call}
+
+
+def send_event(url: str, event: dict, api_key: str) -> tuple[int, str]:
+    """Posts the event with an X-Retell-Signature header. Returns (HTTP status, body)."""
+    body = json.dumps(event, separators=(",", ":"), ensure_ascii=False)
+    signature = symmetric["sign"](body, api_key)  # type: ignore
+    req = urllib.request.Request(
+        url,
+        data=body.encode("utf-8"),
+        headers={"Content-Type": "application/json", "X-Retell-Signature": signature},
+        method="POST",
+    )
+    try:
+        with urllib.request.urlopen(req) as resp:
+            return resp.status, resp.read().decode("utf-8")
+    except urllib.error.HTTPError as e:
+        return e.code, e.read().decode("utf-8")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Send a fake Retell call event to the backend")
+    parser.add_argument("call_id")
+    parser.add_argument("--status", default="ended", choices=["ended", "error", "not_connected"])
+    parser.add_argument("--schedules", default="not required", help="value of the callSchedules variable")
+    parser.add_argument("--transcript", default="Agent: Hello.\nUser: Hi.")
+    parser.add_argument("--url", default="http://localhost:8080/api/retell/webhook")
+    args = parser.parse_args()
+
+    event = build_event(args.call_id, args.status, args.schedules, args.transcript)
+    status, body = send_event(args.url, event, os.environ["RETELL_API_KEY"])
+    print(status, body)
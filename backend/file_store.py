@@ -1,26 +1,67 @@
-import json
+import bisect
 import uuid
 import os
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Iterator, List, Tuple
 from threading import Lock
 
+try:
+    import fcntl
+except ImportError:  # Windows: only the in-process lock applies
+    fcntl = None  # type: ignore[assignment]
+
+import metrics
+from serializers import Serializer, detect_format, get_serializer
+
+FILE_IO_SECONDS = metrics.histogram(
+    "file_store_io_seconds", "Time to read or rewrite the whole sessions_store.json", ("op",)
+)
+
 
 class FileSessionStore:
     """
     File system session store.
     All sessions are stored in a single file as a map: session_id -> session_data
+    Writes hold an exclusive lock on sessions_store.lock, so several processes on the same host
+    can share the store (readers need no lock: the file is replaced atomically).
+
+    The file is encoded with file_format ("json": compact JSON, or "msgpack"); files in the other
+    format (or the old indented JSON) are read as well and converted on the next write.
+    The file is named sessions_store.json in every format on purpose: processes with either setting,
+    the sqlite and log stores seeding from it and migrate_store all find it under one name, and the
+    format is detected from its contents.
+    Encoded records are kept in memory: the file is only read again after another process
+    replaced it, reads decode just the records they return, and a write encodes only the
+    sessions it changed.
+    For list_sessions and get_by_status, (created_at, session_id) keys are kept in sorted lists,
+    one for all sessions and one per status. They are updated on every write; after the file was
+    read again they are rebuilt on the next listing, decoding only the records that changed.
     """
 
-    def __init__(self, base_dir: str = "sessions", ext: str = ".json"):
+    def __init__(self, base_dir: str = "sessions", ext: str = ".json", file_format: str = "json"):
         self.base_dir = Path(base_dir)
         self.base_dir.mkdir(parents=True, exist_ok=True)
         self.store_path = self.base_dir / "sessions_store.json"
+        self.lock_path = self.base_dir / "sessions_store.lock"
+        self.serializer: Serializer = get_serializer(file_format)
         self._lock = Lock()
-        
+        # session_id -> record encoded with self.serializer, as of the file version in _stamp
+        self._encoded: Dict[str, bytes] = {}
+        self._stamp: Optional[Tuple[int, ...]] = None
+        # Records changed since the last write, encoded when the file is written
+        self._dirty: Dict[str, Dict[str, Any]] = {}
+        # session_id -> (encoded record, (created_at, session_id) listing key, status) as of the last indexing
+        self._keys: Dict[str, Tuple[bytes, Tuple[float, str], Optional[str]]] = {}
+        # Sorted listing keys of all sessions, and per status; stale while _indexed is False
+        self._created: List[Tuple[float, str]] = []
+        self._by_status: Dict[Optional[str], List[Tuple[float, str]]] = {}
+        self._indexed = True
+
         # Initialize store file if it doesn't exist
-        if not self.store_path.exists():
-            self._atomic_write({})
+        with self._write_lock():
+            if not self.store_path.exists():
+                self._flush()
 
     # --- public API ---
 
@@ -30,75 +71,222 @@ class FileSessionStore:
         If session_id is not passed — generate UUID.
         """
         sid = session_id or str(uuid.uuid4())
-        with self._lock:
-            store = self._read_store()
-            if sid in store:
+        with self._write_lock():
+            self._load()
+            if sid in self._encoded:
                 raise FileExistsError(f"Session '{sid}' already exists")
-            store[sid] = initial
-            self._atomic_write(store)
+            self._dirty[sid] = initial
+            self._flush()
         return sid
 
     def get(self, session_id: str) -> Dict[str, Any]:
         """Returns the session data. Throws KeyError if session does not exist."""
         with self._lock:
-            store = self._read_store()
-            if session_id not in store:
-                raise FileNotFoundError(f"Session '{session_id}' not found")
-            return store[session_id]
+            self._load()
+            return self._record(session_id)
 
     def get_by_status(self, status: str) -> Dict[str, Any]:
-        """Returns the session data by status."""
+        """Returns the session data by status. Only the sessions with that status are decoded."""
         with self._lock:
-            store = self._read_store()
-            return {sid: sess for sid, sess in store.items() if sess['status'] == status}
+            self._load()
+            self._reindex()
+            return {sid: self._record(sid) for _, sid in self._by_status.get(status, [])}
 
     def set(self, session_id: str, data: Dict[str, Any]) -> None:
         """Completely replaces the session content with the passed dictionary."""
-        with self._lock:
-            store = self._read_store()
-            if session_id not in store:
+        with self._write_lock():
+            self._load()
+            if session_id not in self._encoded:
                 raise FileNotFoundError(f"Session '{session_id}' not found")
-            store[session_id] = data
-            self._atomic_write(store)
+            self._dirty[session_id] = data
+            self._flush()
 
     def update(self, session_id: str, patch: Dict[str, Any]) -> Dict[str, Any]:
         """
         Partial update: shallow-merge patch into existing data.
         Returns the updated data.
         """
-        with self._lock:
-            store = self._read_store()
-            if session_id not in store:
-                raise FileNotFoundError(f"Session '{session_id}' not found")
-            store[session_id].update(patch)
-            self._atomic_write(store)
-            return store[session_id]
+        with self._write_lock():
+            self._load()
+            current = self._record(session_id)
+            current.update(patch)
+            self._dirty[session_id] = current
+            self._flush()
+            return current
+
+    def compare_and_update(
+        self, session_id: str, expected: Dict[str, Any], patch: Dict[str, Any]
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Applies the patch only if every key in expected currently has that value (missing keys count as None).
+        Returns the updated data, or None if the session did not match.
+        """
+        with self._write_lock():
+            self._load()
+            current = self._record(session_id)
+            if any(current.get(key) != value for key, value in expected.items()):
+                return None
+            current.update(patch)
+            self._dirty[session_id] = current
+            self._flush()
+            return current
 
     def exists(self, session_id: str) -> bool:
         with self._lock:
-            store = self._read_store()
-            return session_id in store
+            self._load()
+            return session_id in self._encoded
 
     def delete(self, session_id: str) -> None:
+        with self._write_lock():
+            self._load()
+            if session_id in self._encoded:
+                del self._encoded[session_id]
+                self._list_remove(session_id)
+                self._flush()
+
+    def list_sessions(
+        self,
+        status: Optional[str] = None,
+        created_after: Optional[float] = None,
+        created_before: Optional[float] = None,
+        cursor: Optional[Tuple[float, str]] = None,
+        limit: int = 50,
+    ) -> List[Tuple[str, Dict[str, Any]]]:
+        """
+        Returns up to limit sessions, newest first, with created_after <= created_at < created_before,
+        starting after the cursor. Pages are sliced from the sorted listing keys by binary search,
+        so only the returned sessions are decoded.
+        """
         with self._lock:
-            store = self._read_store()
-            if session_id in store:
-                del store[session_id]
-                self._atomic_write(store)
+            self._load()
+            self._reindex()
+            keys = self._created if status is None else self._by_status.get(status, [])
+            hi = len(keys)
+            if created_before is not None:
+                hi = bisect.bisect_left(keys, (created_before, ""))
+            if cursor is not None:
+                hi = min(hi, bisect.bisect_left(keys, tuple(cursor)))
+            lo = max(hi - limit, 0)
+            if created_after is not None:
+                lo = max(lo, bisect.bisect_left(keys, (created_after, "")))
+            return [(sid, self._record(sid)) for _, sid in reversed(keys[lo:hi])]
+
+    def rewrite(self) -> int:
+        """Rewrites the whole file in this store's format (see migrate_store). Returns the number of sessions."""
+        with self._write_lock():
+            self._stamp = None  # read the file even if it is cached
+            self._load()
+            self._flush()
+            return len(self._encoded)
 
     # --- internal ---
 
-    def _read_store(self) -> Dict[str, Dict[str, Any]]:
-        """Reads the entire store file."""
+    @contextmanager
+    def _write_lock(self) -> Iterator[None]:
+        """Serializes read-modify-write cycles across threads and processes."""
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            with open(self.lock_path, "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _record(self, session_id: str) -> Dict[str, Any]:
+        """Decodes one session (a fresh dict the caller may change)."""
+        if session_id not in self._encoded:
+            raise FileNotFoundError(f"Session '{session_id}' not found")
+        return self.serializer.decode(self._encoded[session_id])
+
+    def _load(self) -> None:
+        """Reads the store file again if it changed since it was last read or written. Call with _lock held."""
         try:
-            with open(self.store_path, "r", encoding="utf-8") as f:
-                return json.load(f)
+            with open(self.store_path, "rb") as f:
+                stamp = _file_stamp(os.fstat(f.fileno()))
+                if stamp == self._stamp:
+                    return
+                with FILE_IO_SECONDS.time(op="read"):
+                    self._encoded = self._split(f.read())
         except FileNotFoundError:
+            stamp = None
+            self._encoded = {}
+        self._indexed = False
+        self._stamp = stamp
+
+    def _reindex(self) -> None:
+        """Rebuilds the listing keys after the file was read again, decoding only the records that changed."""
+        if self._indexed:
+            return
+        keys = {}
+        for sid, data in self._encoded.items():
+            known = self._keys.get(sid)
+            if known is not None and known[0] == data:
+                keys[sid] = known
+            else:
+                keys[sid] = (data, *self._listing_key(sid, self.serializer.decode(data)))
+        self._keys = keys
+        self._created = sorted(key for _, key, _ in keys.values())
+        self._by_status = {}
+        for _, key, status in keys.values():
+            self._by_status.setdefault(status, []).append(key)
+        for status_keys in self._by_status.values():
+            status_keys.sort()
+        self._indexed = True
+
+    def _listing_key(self, session_id: str, sess: Dict[str, Any]) -> Tuple[Tuple[float, str], Optional[str]]:
+        return (sess.get("created_at") or 0.0, session_id), sess.get("status")
+
+    def _list_add(self, session_id: str, sess: Dict[str, Any]) -> None:
+        if not self._indexed:
+            return  # picked up by the next _reindex
+        key, status = self._listing_key(session_id, sess)
+        self._keys[session_id] = (self._encoded[session_id], key, status)
+        bisect.insort(self._created, key)
+        bisect.insort(self._by_status.setdefault(status, []), key)
+
+    def _list_remove(self, session_id: str) -> None:
+        if not self._indexed or session_id not in self._keys:
+            return
+        _, key, status = self._keys.pop(session_id)
+        for keys in (self._created, self._by_status.get(status, [])):
+            i = bisect.bisect_left(keys, key)
+            if i < len(keys) and keys[i] == key:
+                del keys[i]
+
+    def _split(self, data: bytes) -> Dict[str, bytes]:
+        """Encoded records of a store file, converted to this store's format if needed."""
+        if not data.strip():
             return {}
+        file_format = detect_format(data)
+        if file_format == self.serializer.name:
+            return self.serializer.split(data)
+        source = get_serializer(file_format)
+        return {sid: self.serializer.encode(source.decode(record)) for sid, record in source.split(data).items()}
+
+    def _flush(self) -> None:
+        """Encodes the dirty records and atomically writes the entire store. Call with _write_lock held."""
+        try:
+            with FILE_IO_SECONDS.time(op="write"):
+                for sid, record in self._dirty.items():
+                    self._encoded[sid] = self.serializer.encode(record)
+                    self._list_remove(sid)
+                    self._list_add(sid, record)
+                tmp = self.store_path.with_suffix(".tmp")
+                with open(tmp, "wb") as f:
+                    f.write(self.serializer.join(self._encoded))
+                os.replace(tmp, self.store_path)
+                self._stamp = _file_stamp(os.stat(self.store_path))
+        except BaseException:
+            # The cached records may now differ from the file: read it again next time
+            self._stamp = None
+            raise
+        finally:
+            self._dirty.clear()
+
 
-    def _atomic_write(self, data: Dict[str, Dict[str, Any]]) -> None:
-        """Atomically writes the entire store."""
-        tmp = self.store_path.with_suffix(".tmp")
-        with open(tmp, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-        os.replace(tmp, self.store_path)
\ No newline at end of file
+def _file_stamp(st: os.stat_result) -> Tuple[int, ...]:
+    """Identifies a version of the store file: every write replaces it with a new inode."""
+    return (st.st_ino, st.st_size, st.st_mtime_ns, st.st_ctime_ns)
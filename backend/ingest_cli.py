@@ -0,0 +1,198 @@
+"""
+Bulk ingestion of existing notes: parses every document in a directory and creates a session for it.
+
+Usage:
+    python ingest_cli.py <directory> [--workers 4] [--rate 2] [--manifest path] [--store sqlite] [--upload-dir uploaded_notes]
+
+Progress is appended to a manifest, so an interrupted run can simply be started again:
+documents already ingested are skipped, and every document maps to a session id derived
+from its content hash, so no session is ever created twice.
+Use a store that is safe across processes (--store sqlite) if the backend runs at the same time.
+Documents are copied into the backend's upload folder under their content hash, like uploads,
+so the directory can be removed once the run is complete.
+"""
+import argparse
+import json
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Any
+
+from session_store import SessionStore, open_store
+from parse_cache import file_sha256
+from create_session import create_session, parse_session
+
+SUPPORTED_EXTENSIONS = {".pdf", ".png", ".jpg", ".jpeg", ".webp", ".tif", ".tiff", ".gif", ".bmp"}
+
+# Namespace for session ids of ingested documents: uuid5(namespace, sha256 of the file)
+INGEST_NAMESPACE = uuid.UUID("3f1c6f4e-2b0e-4a8e-9a55-6d1f0c1b7e21")
+
+
+class RateLimiter:
+    """Allows at most `rate` acquisitions per second across threads (rate <= 0 disables the limit)."""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+class Manifest:
+    """Append-only JSON-lines checkpoint: one record per processed document, keyed by content hash."""
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.done: dict[str, dict[str, Any]] = {}
+        self._in_progress: set[str] = set()
+        self._lock = threading.Lock()
+        if self.path.exists():
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # torn last line of an interrupted run
+                    if record.get("status") == "done":
+                        self.done[record["sha256"]] = record
+
+    def claim(self, sha256: str) -> bool:
+        """Marks a document as being processed; False if it is done or another worker has it."""
+        with self._lock:
+            if sha256 in self.done or sha256 in self._in_progress:
+                return False
+            self._in_progress.add(sha256)
+            return True
+
+    def release(self, sha256: str) -> None:
+        with self._lock:
+            self._in_progress.discard(sha256)
+
+    def record(self, entry: dict[str, Any]) -> None:
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            if entry["status"] == "done":
+                self.done[entry["sha256"]] = entry
+
+
+def find_documents(directory: str) -> list[Path]:
+    """All supported documents under directory, in a stable order."""
+    return sorted(
+        p for p in Path(directory).rglob("*")
+        if p.is_file() and p.suffix.lower() in SUPPORTED_EXTENSIONS
+    )
+
+
+def ingest_file(path: Path, store: SessionStore, manifest: Manifest, limiter: RateLimiter, upload_dir: str) -> str:
+    """
+    Creates the session for one document unless it was ingested before.
+    Returns "created", "resumed" or "skipped".
+    - upload_dir: the backend's upload folder, where the document is copied
+    """
+    sha256 = file_sha256(path.as_posix())
+    # Duplicates of a document (in this run or an earlier one) are ingested once
+    if not manifest.claim(sha256):
+        return "skipped"
+    try:
+        outcome = _ingest_document(path, sha256, store, limiter, upload_dir)
+        manifest.record({"path": path.as_posix(), "sha256": sha256, "session_id": _session_id(sha256), "status": "done"})
+        return outcome
+    finally:
+        manifest.release(sha256)
+
+
+def _session_id(sha256: str) -> str:
+    return str(uuid.uuid5(INGEST_NAMESPACE, sha256))
+
+
+def _ingest_document(path: Path, sha256: str, store: SessionStore, limiter: RateLimiter, upload_dir: str) -> str:
+    session_id = _session_id(sha256)
+    status = store.get(session_id).get("status") if store.exists(session_id) else None
+    if status is None or status == "parse_failed":
+        if status == "parse_failed":
+            store.delete(session_id)
+        limiter.acquire()
+        from upload_store import store_file  # imports Flask, so only once a document is ingested
+        # The hash is stored with the session, so parsing does not read the file again for the cache key
+        stored = store_file(path.as_posix(), sha256, upload_dir)
+        create_session(stored.path, store, session_id=session_id, file_info={
+            "file_sha256": sha256,
+            "file_size": stored.size,
+            "original_filename": stored.original_filename,
+        })
+        return "created"
+    if status == "parsing":
+        # Interrupted in the middle of parsing
+        limiter.acquire()
+        parse_session(session_id, store)
+        return "resumed"
+    # The session was created, but the run stopped before the manifest was written
+    return "skipped"
+
+
+def run(
+    directory: str, store: SessionStore, manifest: Manifest, workers: int, rate: float, upload_dir: str = "uploaded_notes"
+) -> dict[str, Any]:
+    """Ingests a directory and returns a summary of the run."""
+    documents = find_documents(directory)
+    limiter = RateLimiter(rate)
+    counts = {"created": 0, "resumed": 0, "skipped": 0, "failed": 0}
+    failures: list[dict[str, str]] = []
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ingest") as executor:
+        futures = {executor.submit(ingest_file, path, store, manifest, limiter, upload_dir): path for path in documents}
+        for i, future in enumerate(as_completed(futures), 1):
+            path = futures[future]
+            try:
+                counts[future.result()] += 1
+            except Exception as e:
+                counts["failed"] += 1
+                failures.append({"path": path.as_posix(), "error": str(e)})
+                manifest.record({"path": path.as_posix(), "sha256": "", "status": "failed", "error": str(e)})
+            if i % 10 == 0 or i == len(documents):
+                print(f"[Ingest] {i}/{len(documents)} documents processed")
+    elapsed = time.monotonic() - start
+
+    processed = counts["created"] + counts["resumed"]
+    return {
+        "documents": len(documents),
+        **counts,
+        "elapsed_seconds": round(elapsed, 3),
+        "documents_per_second": round(processed / elapsed, 3) if elapsed > 0 else 0.0,
+        "failures": failures,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create sessions for every note in a directory")
+    parser.add_argument("directory")
+    parser.add_argument("--workers", type=int, default=4, help="documents parsed at once")
+    parser.add_argument("--rate", type=float, default=2.0, help="max documents started per second (0 = unlimited)")
+    parser.add_argument("--manifest", default=None, help="checkpoint file (default: <base-dir>/ingest_manifest.jsonl)")
+    parser.add_argument("--store", default=None, help="session store backend: file, log or sqlite")
+    parser.add_argument("--base-dir", default="sessions", help="session store directory")
+    parser.add_argument("--upload-dir", default="uploaded_notes", help="the backend's upload folder (documents are copied here)")
+    args = parser.parse_args()
+
+    manifest = Manifest(args.manifest or str(Path(args.base_dir) / "ingest_manifest.jsonl"))
+    summary = run(
+        args.directory, open_store(args.store, base_dir=args.base_dir), manifest, args.workers, args.rate, args.upload_dir
+    )
+
+    for failure in summary["failures"]:
+        print(f"[Ingest] FAILED {failure['path']}: {failure['error']}")
+    print(json.dumps({k: v for k, v in summary.items() if k != "failures"}, indent=2))
@@ -0,0 +1,69 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+from session_store import SessionStore
+from create_session import parse_session
+
+
+class IngestionPool:
+    """
+    Parses uploaded documents in background threads, so uploads return before parse_doc runs.
+    - max_workers: number of documents parsed at once
+    """
+
+    def __init__(self, store: SessionStore, max_workers: int = 4):
+        self.store = store
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingestion")
+        self._in_progress: set[str] = set()
+        self._changed = threading.Condition()
+
+    def submit(self, session_id: str) -> None:
+        """Schedules parsing of a session in the "parsing" state."""
+        with self._changed:
+            if session_id in self._in_progress:
+                return
+            self._in_progress.add(session_id)
+        self._executor.submit(self._run, session_id)
+
+    def resume(self) -> int:
+        """Re-submits sessions left in "parsing" (e.g. by a restart). Returns how many."""
+        sessions = self.store.get_by_status("parsing")
+        for session_id in sessions:
+            self.submit(session_id)
+        return len(sessions)
+
+    def wait(self, session_id: str, timeout: float) -> dict[str, Any]:
+        """
+        Long-poll helper: returns the session once it has left "parsing" or the timeout expired.
+        Wakes up as soon as a local worker finishes, and re-reads the store at least every second
+        in case the session is parsed by another process.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            sess = self.store.get(session_id)
+            remaining = deadline - time.monotonic()
+            if sess.get("status") != "parsing" or remaining <= 0:
+                return sess
+            with self._changed:
+                self._changed.wait(min(remaining, 1.0))
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._executor.shutdown(wait=wait)
+
+    def stats(self) -> dict[str, int]:
+        with self._changed:
+            return {"in_progress": len(self._in_progress)}
+
+    # --- internal ---
+
+    def _run(self, session_id: str) -> None:
+        try:
+            parse_session(session_id, self.store)
+        except Exception:
+            pass  # already recorded as parse_failed on the session
+        finally:
+            with self._changed:
+                self._in_progress.discard(session_id)
+                self._changed.notify_all()
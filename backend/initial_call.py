@@ -1,24 +1,48 @@
 import json
 import os
 import time
-from retell import Retell
+from typing import Any, Final
 
-# Initialize Retell client
-client = Retell(api_key=os.environ["RETELL_API_KEY"])
+import metrics
+from api_client import LazyClient, RateLimitedClient, parse_rate_limits, pooled_http_client
+from agent_registry import AgentRegistry, config_hash
 
+# Rate limits per endpoint, e.g. RETELL_RATE_LIMITS="call.create_phone_call=1,call.retrieve=10"
+RETELL_MAX_CONCURRENCY = int(os.environ.get("RETELL_MAX_CONCURRENCY", "8"))
 
-def get_or_create_patient_agent():
-    """Get existing agent or create new one if it doesn't exist"""
 
-    # # First, try to find existing agent by name
-    # agents = client.agent.list()
+def _create_client() -> Any:
+    from retell import Retell
+    return Retell(
+        api_key=os.environ["RETELL_API_KEY"],
+        max_retries=0,  # retries are done by the wrapper
+        http_client=pooled_http_client(RETELL_MAX_CONCURRENCY),
+    )
+
+
+def _rate_limited(client: Any) -> RateLimitedClient:
+    from retell import APIConnectionError
+    return RateLimitedClient(
+        client,
+        api="retell",
+        rate_limits=parse_rate_limits(os.environ.get("RETELL_RATE_LIMITS", "")),
+        max_concurrency=RETELL_MAX_CONCURRENCY,
+        max_retries=int(os.environ.get("API_MAX_RETRIES", "4")),
+        # Placing a call or creating an agent is only retried when Retell refused the request
+        idempotent={"call.retrieve"},
+        connection_errors=(APIConnectionError,),
+    )
+
 
-    # for agent in agents:
-    #     if agent.agent_name == "Patient Care Agent":
-    #         return agent.agent_id
+# The rate limited Retell client, created on first use, so importing this module needs no API key
+client = LazyClient(_create_client, _rate_limited)
 
-    # If no existing agent found, create new one
-    return create_patient_agent()
+CALL_API_SECONDS = metrics.histogram(
+    "call_api_seconds", "Time of call operations: make_patient_call, create_agent", ("op",)
+)
+
+# Agents created for each configuration, reused across calls and restarts
+agent_registry = AgentRegistry(os.environ.get("AGENT_REGISTRY_PATH", "sessions/agent_registry.json"))
 
 
 general_prompt = """You are a medical assistant calling patients to discuss their medical data.
@@ -47,66 +71,112 @@ Instructions:
 - Try to not repeat yourself.
 - If you hear that patient wants reminders, scheduled calls or asks anything about reminders for medications, then you should call the capture_call_schedules function.
 - If you hear that patient doesn't want reminders, then you should call the end_call function.
+- If {{patient_data}} contains "medication_reminder", this is a reminder call: greet the patient, remind them to take the medication from "medication_reminder", answer short questions and end the call. Do not ask about reminders again.
 
 Initial message: Parse {{patient_data}} to get the patient's name and medical information, then say "Hello [patient_name], this is calling from your doctor's office. I'm calling to discuss your recent medical results and answer any questions you might have about them. Also I can help you schedule reminder calls for taking your medications."
 
 Remember: All medical information you discuss should come from the {{patient_data}} JSON. Do not make up or assume any medical information not present in the data."""
 
 
-def create_patient_agent():
-    """Create a new patient care agent (only called if none exists)"""
-
-    # Create Retell LLM
-    llm_response = client.llm.create(
-        general_prompt=general_prompt,
-        model="gpt-5",
-        model_temperature=0.3,
-        general_tools=[
+general_tools = [
+    {
+        "type": "extract_dynamic_variable",
+        "name": "capture_call_schedules",
+        "description": "Capture medication reminder scheduling preferences - MUST be called before ending conversation",
+        "variables": [
             {
-                "type": "extract_dynamic_variable",
-                "name": "capture_call_schedules",
-                "description": "Capture medication reminder scheduling preferences - MUST be called before ending conversation",
-                "variables": [
-                    {
-                        "name": "callSchedules",
-                        "type": "string",
-                        "description": "Either 'not required' if patient doesn't want reminders, or JSON array of medication schedules like: [{\"medicationName\": \"Lisinopril\", \"time\": \"8:00 AM every day\"}, {\"medicationName\": \"Atorvastatin\", \"time\": \"10:00 PM every day\"}]",
-                        "examples": [
-                            "not required",
-                            "[{\"medicationName\": \"Lisinopril\", \"time\": \"8:00 AM every day\"}, {\"medicationName\": \"Atorvastatin\", \"time\": \"10:00 PM every day\"}]"
-                        ]
-                    }
+                "name": "callSchedules",
+                "type": "string",
+                "description": "Either 'not required' if patient doesn't want reminders, or JSON array of medication schedules like: [{\"medicationName\": \"Lisinopril\", \"time\": \"8:00 AM every day\"}, {\"medicationName\": \"Atorvastatin\", \"time\": \"10:00 PM every day\"}]",
+                "examples": [
+                    "not required",
+                    "[{\"medicationName\": \"Lisinopril\", \"time\": \"8:00 AM every day\"}, {\"medicationName\": \"Atorvastatin\", \"time\": \"10:00 PM every day\"}]"
                 ]
-            }, # type: ignore
-            {
-                "type": "end_call",
-                "name": "end_call",
-                "description": "End the call politely after capturing call schedules"
             }
         ]
+    },
+    {
+        "type": "end_call",
+        "name": "end_call",
+        "description": "End the call politely after capturing call schedules"
+    }
+]
+
+agent_name: Final = "Patient Care Agent"
+llm_model: Final = "gpt-5"
+llm_temperature: Final = 0.3
+voice_id: Final = "11labs-Adrian"
+voice_speed: Final = 0.8
+# Retell posts call events (call_ended, ...) here; see the /api/retell/webhook endpoint
+webhook_url = os.environ.get("RETELL_WEBHOOK_URL") or None
+
+# Call statuses after which nothing else happens to the call
+FINISHED_CALL_STATUSES = ('ended', 'error', 'not_connected')
+
+
+def patient_agent_config() -> dict:
+    """Everything that defines the patient agent; a change here produces a new agent."""
+    return {
+        "agent_name": agent_name,
+        "general_prompt": general_prompt,
+        "general_tools": general_tools,
+        "model": llm_model,
+        "model_temperature": llm_temperature,
+        "voice_id": voice_id,
+        "voice_speed": voice_speed,
+        # Left out when unset, so the hash of existing agents stays the same
+        **({"webhook_url": webhook_url} if webhook_url else {}),
+    }
+
+
+def get_or_create_patient_agent():
+    """Get the agent for the current configuration, creating it only if the configuration is new"""
+
+    entry = agent_registry.get_or_create(
+        config_hash(patient_agent_config()),
+        lambda: {**create_patient_agent(), "created_at": time.time()},
+    )
+    return entry["agent_id"]
+
+
+@CALL_API_SECONDS.time(op="create_agent")
+def create_patient_agent() -> dict[str, str]:
+    """Create a new patient care agent (only called if none exists); returns its agent_id and llm_id"""
+
+    from retell import NOT_GIVEN
+
+    # Create Retell LLM
+    llm_response = client.get().llm.create(
+        general_prompt=general_prompt,
+        general_tools=general_tools,  # type: ignore
+        model=llm_model,
+        model_temperature=llm_temperature,
     )
 
     # Create agent
-    agent_response = client.agent.create(
-        agent_name="Patient Care Agent",
-        voice_id="11labs-Adrian",
-        voice_speed=0.8,
+    agent_response = client.get().agent.create(
+        agent_name=agent_name,
         response_engine={
             "type": "retell-llm",
             "llm_id": llm_response.llm_id
-        }
+        },
+        voice_id=voice_id,
+        voice_speed=voice_speed,
+        webhook_url=webhook_url or NOT_GIVEN,
     )
+    print(f"[Agent] Created agent {agent_response.agent_id} (llm {llm_response.llm_id})")
 
-    return agent_response.agent_id
+    return {"agent_id": agent_response.agent_id, "llm_id": llm_response.llm_id}
 
 
+@CALL_API_SECONDS.time(op="make_patient_call")
 def make_patient_call(patient_data):
     """Make a call using existing agent with patient-specific data"""
 
     # Get existing agent (or create if doesn't exist)
     agent_id = get_or_create_patient_agent()
 
-    call_response = client.call.create_phone_call(
+    call_response = client.get().call.create_phone_call(
         from_number="+12293184505",
         # to_number="+15103690090",
         to_number="+16502182328",
@@ -119,31 +189,17 @@ def make_patient_call(patient_data):
     return call_response
 
 
-def wait_for_call_completion(call_id, timeout_seconds=3600):
-    """Wait for call to finish and return final call details"""
-
-    start_time = time.time()
-
-    while time.time() - start_time < timeout_seconds:
-        try:
-            # Get current call status
-            call_details = client.call.retrieve(call_id)
+def get_call_details(call_id):
+    """Return current call details, or None if they could not be fetched"""
 
-            # Check if call is finished
-            if call_details.call_status in ['ended', 'error', 'not_connected']:
-                print(
-                    f"[Scheduler] Call {call_id} finished with status: {call_details.call_status}")
-                return call_details
+    try:
+        return client.get().call.retrieve(call_id)
+    except Exception as e:
+        print(f"[Scheduler] Error checking call status: {e}")
+        return None
 
-            # Call is still in progress
-            print(
-                f"[Scheduler] Call {call_id} status: {call_details.call_status}, waiting...")
-            time.sleep(5)  # Wait 5 seconds before checking again
 
-        except Exception as e:
-            print(f"[Scheduler] Error checking call status: {e}")
-            time.sleep(5)
+def verify_webhook(body: str, signature: str) -> bool:
+    """Check the X-Retell-Signature header of a webhook request against its raw body"""
 
-    # Timeout reached
-    print(f"[Scheduler] Timeout waiting for call {call_id} to complete")
-    return None
+    return bool(signature) and bool(client.get().verify(body, os.environ["RETELL_API_KEY"], signature))
@@ -0,0 +1,336 @@
+import bisect
+import copy
+import json
+import os
+import threading
+import uuid
+from pathlib import Path
+from typing import Optional, Dict, Any, IO, List, Tuple
+from threading import Lock
+
+from serializers import load_store_file
+
+
+class LogSessionStore:
+    """
+    Append-only log session store.
+    Every mutation is appended to a log file as one JSON line, the current state
+    (session_id -> session_data) is kept in memory and rebuilt from the log on startup.
+    Stale records are dropped by a background compaction that rewrites the log.
+    The state lives in one process, so the log must not be shared by several processes.
+    Records in memory are never modified in place (a patch replaces the session's dict), so
+    compaction can snapshot the state with a shallow copy.
+    For list_sessions, (created_at, session_id) keys are kept in sorted lists, one for all
+    sessions and one per status.
+    """
+
+    def __init__(
+        self,
+        base_dir: str = "sessions",
+        fsync: bool = True,
+        compact_interval: float = 30.0,
+        compact_min_records: int = 1000,
+        compact_ratio: float = 1.0,
+    ):
+        self.base_dir = Path(base_dir)
+        self.base_dir.mkdir(parents=True, exist_ok=True)
+        self.log_path = self.base_dir / "sessions_store.log"
+        self.fsync = fsync
+        self.compact_min_records = compact_min_records
+        self.compact_ratio = compact_ratio
+        self._lock = Lock()
+        self._compact_lock = Lock()
+        self._index: Dict[str, Dict[str, Any]] = {}
+        self._stale = 0  # records in the log that no longer describe live state
+        # Sorted (created_at, session_id) keys of all sessions, and per status
+        self._created: List[Tuple[float, str]] = []
+        self._by_status: Dict[Optional[str], List[Tuple[float, str]]] = {}
+
+        if not self.log_path.exists():
+            self._seed_from_json_store()
+        self._replay()
+        for sid, sess in self._index.items():
+            self._created.append(self._listing_key(sid, sess))
+            self._by_status.setdefault(sess.get("status"), []).append(self._listing_key(sid, sess))
+        self._created.sort()
+        for keys in self._by_status.values():
+            keys.sort()
+        self._log: IO[bytes] = open(self.log_path, "ab")
+        self._failed: Optional[OSError] = None  # set when a failed append could not be rolled back
+
+        self._stop = threading.Event()
+        self._compactor: Optional[threading.Thread] = None
+        if compact_interval > 0:
+            self._compactor = threading.Thread(
+                target=self._compact_loop, args=(compact_interval,), name="log-store-compactor", daemon=True
+            )
+            self._compactor.start()
+
+    # --- public API ---
+
+    def create(self, initial: Dict[str, Any], session_id: Optional[str] = None) -> str:
+        """
+        Creates a new session and writes the initial data.
+        If session_id is not passed — generate UUID.
+        """
+        sid = session_id or str(uuid.uuid4())
+        with self._lock:
+            if sid in self._index:
+                raise FileExistsError(f"Session '{sid}' already exists")
+            self._append({"op": "put", "id": sid, "data": initial})
+            self._index[sid] = copy.deepcopy(initial)
+            self._list_add(sid, self._index[sid])
+        return sid
+
+    def get(self, session_id: str) -> Dict[str, Any]:
+        """Returns the session data. Throws FileNotFoundError if session does not exist."""
+        with self._lock:
+            if session_id not in self._index:
+                raise FileNotFoundError(f"Session '{session_id}' not found")
+            return copy.deepcopy(self._index[session_id])
+
+    def get_by_status(self, status: str) -> Dict[str, Any]:
+        """Returns the session data by status."""
+        with self._lock:
+            return {
+                sid: copy.deepcopy(sess) for sid, sess in self._index.items() if sess.get('status') == status
+            }
+
+    def set(self, session_id: str, data: Dict[str, Any]) -> None:
+        """Completely replaces the session content with the passed dictionary."""
+        with self._lock:
+            if session_id not in self._index:
+                raise FileNotFoundError(f"Session '{session_id}' not found")
+            self._append({"op": "put", "id": session_id, "data": data})
+            self._list_remove(session_id, self._index[session_id])
+            self._index[session_id] = copy.deepcopy(data)
+            self._list_add(session_id, self._index[session_id])
+            self._stale += 1
+
+    def update(self, session_id: str, patch: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Partial update: shallow-merge patch into existing data.
+        Only the patch is appended to the log. Returns the updated data.
+        """
+        with self._lock:
+            if session_id not in self._index:
+                raise FileNotFoundError(f"Session '{session_id}' not found")
+            self._append({"op": "patch", "id": session_id, "data": patch})
+            self._patch(session_id, patch)
+            return copy.deepcopy(self._index[session_id])
+
+    def compare_and_update(
+        self, session_id: str, expected: Dict[str, Any], patch: Dict[str, Any]
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Applies the patch only if every key in expected currently has that value (missing keys count as None).
+        Returns the updated data, or None if the session did not match.
+        """
+        with self._lock:
+            if session_id not in self._index:
+                raise FileNotFoundError(f"Session '{session_id}' not found")
+            current = self._index[session_id]
+            if any(current.get(key) != value for key, value in expected.items()):
+                return None
+            self._append({"op": "patch", "id": session_id, "data": patch})
+            self._patch(session_id, patch)
+            return copy.deepcopy(self._index[session_id])
+
+    def exists(self, session_id: str) -> bool:
+        with self._lock:
+            return session_id in self._index
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            if session_id in self._index:
+                self._append({"op": "del", "id": session_id})
+                self._list_remove(session_id, self._index.pop(session_id))
+                self._stale += 2
+
+    def list_sessions(
+        self,
+        status: Optional[str] = None,
+        created_after: Optional[float] = None,
+        created_before: Optional[float] = None,
+        cursor: Optional[Tuple[float, str]] = None,
+        limit: int = 50,
+    ) -> List[Tuple[str, Dict[str, Any]]]:
+        """
+        Returns up to limit sessions, newest first, with created_after <= created_at < created_before,
+        starting after the cursor. Pages are sliced from the sorted listing index by binary search.
+        """
+        with self._lock:
+            keys = self._created if status is None else self._by_status.get(status, [])
+            hi = len(keys)
+            if created_before is not None:
+                hi = bisect.bisect_left(keys, (created_before, ""))
+            if cursor is not None:
+                hi = min(hi, bisect.bisect_left(keys, tuple(cursor)))
+            lo = max(hi - limit, 0)
+            if created_after is not None:
+                lo = max(lo, bisect.bisect_left(keys, (created_after, "")))
+            return [(sid, copy.deepcopy(self._index[sid])) for _, sid in reversed(keys[lo:hi])]
+
+    def compact(self) -> None:
+        """
+        Rewrites the log so that it holds exactly one record per live session.
+        Writers are blocked only while the index is shallow-copied, not while the snapshot
+        is written; records appended meanwhile are copied over before the new log atomically
+        replaces the old one.
+        """
+        with self._compact_lock:
+            with self._lock:
+                self._log.flush()
+                snapshot = dict(self._index)
+                offset = self._log.tell()
+                stale_before = self._stale
+
+            tmp = self.log_path.with_suffix(".compact")
+            with open(tmp, "wb") as f:
+                for sid, data in snapshot.items():
+                    f.write(self._encode({"op": "put", "id": sid, "data": data}))
+
+                with self._lock:
+                    # Copy records appended while the snapshot was being written
+                    self._log.flush()
+                    with open(self.log_path, "rb") as src:
+                        src.seek(offset)
+                        f.write(src.read())
+                    f.flush()
+                    os.fsync(f.fileno())
+                    self._log.close()
+                    os.replace(tmp, self.log_path)
+                    self._log = open(self.log_path, "ab")
+                    self._stale -= stale_before
+
+    def close(self) -> None:
+        """Stops background compaction and closes the log file."""
+        self._stop.set()
+        if self._compactor is not None:
+            self._compactor.join()
+        with self._lock:
+            self._log.close()
+
+    # --- internal ---
+
+    def _encode(self, record: Dict[str, Any]) -> bytes:
+        return (json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+
+    def _append(self, record: Dict[str, Any]) -> None:
+        """
+        Appends one record to the log. The call returns only after the record is durable.
+        If the write fails (ENOSPC, EIO), the log is truncated back to where the record began,
+        so a partial record cannot swallow the records appended after it on replay.
+        """
+        if self._failed is not None:
+            raise OSError(f"Session log {self.log_path} is unusable after a failed write") from self._failed
+        offset = self._log.tell()
+        try:
+            self._log.write(self._encode(record))
+            self._log.flush()
+            if self.fsync:
+                os.fsync(self._log.fileno())
+        except BaseException:
+            self._rollback(offset)
+            raise
+
+    def _rollback(self, offset: int) -> None:
+        """Cuts the log back to offset after a failed append; fails the store if that is not possible."""
+        try:
+            # Closing drops the unwritten rest of the record from the buffer (the flush may fail again)
+            self._log.close()
+        except OSError:
+            pass
+        try:
+            with open(self.log_path, "r+b") as f:
+                f.truncate(offset)
+                f.flush()
+                os.fsync(f.fileno())
+            self._log = open(self.log_path, "ab")
+        except OSError as e:
+            print(f"[LogSessionStore] Could not roll back a failed append at offset {offset}: {e}")
+            self._failed = e
+
+    def _replay(self) -> None:
+        """Rebuilds the in-memory index from the log, dropping a torn trailing record."""
+        valid_bytes = 0
+        records = 0
+        with open(self.log_path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                self._apply(record)
+                valid_bytes += len(line)
+                records += 1
+
+        if valid_bytes != self.log_path.stat().st_size:
+            # The process died in the middle of an append: cut the partial record
+            print(f"[LogSessionStore] Truncating torn record at offset {valid_bytes}")
+            with open(self.log_path, "r+b") as f:
+                f.truncate(valid_bytes)
+        self._stale = records - len(self._index)
+
+    def _patch(self, session_id: str, patch: Dict[str, Any]) -> None:
+        current = self._index[session_id]
+        reindex = "status" in patch or "created_at" in patch
+        if reindex:
+            self._list_remove(session_id, current)
+        # A new dict rather than an in-place update: compaction snapshots may still hold the old one
+        updated = {**current, **copy.deepcopy(patch)}
+        self._index[session_id] = updated
+        if reindex:
+            self._list_add(session_id, updated)
+        self._stale += 1
+
+    def _listing_key(self, session_id: str, sess: Dict[str, Any]) -> Tuple[float, str]:
+        return (sess.get("created_at") or 0.0, session_id)
+
+    def _list_add(self, session_id: str, sess: Dict[str, Any]) -> None:
+        key = self._listing_key(session_id, sess)
+        bisect.insort(self._created, key)
+        bisect.insort(self._by_status.setdefault(sess.get("status"), []), key)
+
+    def _list_remove(self, session_id: str, sess: Dict[str, Any]) -> None:
+        key = self._listing_key(session_id, sess)
+        for keys in (self._created, self._by_status.get(sess.get("status"), [])):
+            i = bisect.bisect_left(keys, key)
+            if i < len(keys) and keys[i] == key:
+                del keys[i]
+
+    def _apply(self, record: Dict[str, Any]) -> None:
+        sid = record["id"]
+        op = record["op"]
+        if op == "put":
+            self._index[sid] = record["data"]
+        elif op == "patch":
+            if sid in self._index:
+                self._index[sid].update(record["data"])
+        elif op == "del":
+            self._index.pop(sid, None)
+
+    def _seed_from_json_store(self) -> None:
+        """Imports an existing sessions_store.json so that switching the store mode keeps the data."""
+        json_path = self.base_dir / "sessions_store.json"
+        tmp = self.log_path.with_suffix(".compact")
+        with open(tmp, "wb") as f:
+            for sid, data in load_store_file(json_path).items():
+                f.write(self._encode({"op": "put", "id": sid, "data": data}))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.log_path)
+
+    def _should_compact(self) -> bool:
+        with self._lock:
+            return self._stale >= max(self.compact_min_records, len(self._index) * self.compact_ratio)
+
+    def _compact_loop(self, interval: float) -> None:
+        while not self._stop.wait(interval):
+            try:
+                if self._should_compact():
+                    self.compact()
+            except Exception as e:
+                print(f"[LogSessionStore] Compaction failed: {e}")
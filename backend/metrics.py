@@ -0,0 +1,185 @@
+"""
+Lightweight in-process metrics: counters, histograms and callback gauges,
+rendered in the Prometheus text exposition format for /api/metrics.
+Recording is a dict lookup and a few additions under a per-metric lock.
+"""
+import bisect
+import threading
+import time
+from contextlib import ContextDecorator
+from typing import Any, Callable, Iterable, Mapping, Optional
+
+# Seconds; covers store operations (sub-millisecond) up to model calls and phone calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+
+LabelValues = tuple[str, ...]
+
+
+def _format_labels(names: tuple[str, ...], values: LabelValues, extra: Optional[tuple[str, str]] = None) -> str:
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    """Monotonically increasing count, optionally per label values."""
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values: dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = tuple(str(labels[n]) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class _Timer(ContextDecorator):
+    """Observes the elapsed time of a with-block or decorated function."""
+
+    def __init__(self, histogram: "Histogram", labels: dict[str, str]):
+        self.histogram = histogram
+        self.labels = labels
+        self._start = 0.0
+
+    def _recreate_cm(self) -> "_Timer":
+        # A fresh timer per decorated call, so concurrent calls do not share a start time
+        return _Timer(self.histogram, self.labels)
+
+    def __enter__(self) -> "_Timer":
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.histogram.observe(time.perf_counter() - self._start, **self.labels)
+
+
+class Histogram:
+    """Distribution of observed values (usually seconds) in cumulative buckets."""
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts..., +Inf count, sum]
+        self._values: dict[LabelValues, list[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(str(labels[n]) for n in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0.0] * (len(self.buckets) + 2)
+            state[index] += 1
+            state[-1] += value
+
+    def time(self, **labels: str) -> _Timer:
+        """Context manager / decorator recording elapsed seconds."""
+        return _Timer(self, labels)
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            values = [(key, list(state)) for key, state in self._values.items()]
+        for key, state in values:
+            cumulative = 0.0
+            for bound, count in zip((*self.buckets, float("inf")), state[:-1]):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, ("le", _format_value(bound)))
+                yield f"{self.name}_bucket{labels} {_format_value(cumulative)}"
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {_format_value(state[-1])}"
+            yield f"{self.name}_count{labels} {_format_value(cumulative)}"
+
+
+class CallbackMetric:
+    """
+    Metric whose values are read from a callback at scrape time: {label value: number}.
+    Used for state owned by other objects (queue sizes, cache counters).
+    """
+
+    def __init__(self, name: str, help: str, callback: Callable[[], Mapping[str, float]],
+                 labelname: str = "", kind: str = "gauge"):
+        self.name = name
+        self.help = help
+        self.callback = callback
+        self.labelname = labelname
+        self.kind = kind
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.kind}"
+        for label, value in self.callback().items():
+            labels = _format_labels((self.labelname,), (label,)) if self.labelname else ""
+            yield f"{self.name}{labels} {_format_value(value)}"
+
+
+class Registry:
+    """Holds all metrics; counter()/histogram() return the existing metric when called again."""
+
+    def __init__(self) -> None:
+        self._metrics: dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, help: str, labelnames: tuple[str, ...] = ()) -> Counter:
+        return self._register(name, lambda: Counter(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: tuple[str, ...] = (),
+                  buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(name, lambda: Histogram(name, help, labelnames, buckets))
+
+    def callback(self, name: str, help: str, callback: Callable[[], Mapping[str, float]],
+                 labelname: str = "", kind: str = "gauge") -> None:
+        """Registers (or replaces) a gauge or counter read from callback() at scrape time."""
+        with self._lock:
+            self._metrics[name] = CallbackMetric(name, help, callback, labelname, kind)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: list[str] = []
+        for metric in metrics:
+            try:
+                lines.extend(list(metric.render()))
+            except Exception as e:
+                print(f"[Metrics] Failed to collect {metric.name}: {e}")
+        return "\n".join(lines) + "\n"
+
+    def _register(self, name: str, factory: Callable[[], Any]) -> Any:
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = factory()
+            return self._metrics[name]
+
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+histogram = REGISTRY.histogram
+callback = REGISTRY.callback
@@ -0,0 +1,43 @@
+"""
+Converts sessions_store.json (the file session store) to another format.
+
+Usage:
+    python migrate_store.py --format msgpack [--base-dir sessions] [--no-backup]
+
+Any existing format is detected, including the old indented JSON. The file keeps its name,
+so set SESSION_FILE_FORMAT to the same format for the backend; otherwise its next write
+converts the file back. The conversion holds the store's write lock, so it is safe
+while the backend is running.
+"""
+import argparse
+import shutil
+from pathlib import Path
+
+from file_store import FileSessionStore
+from serializers import FORMATS, detect_format
+
+
+def migrate(base_dir: str, file_format: str, backup: bool = True) -> None:
+    path = Path(base_dir) / "sessions_store.json"
+    if not path.exists():
+        print(f"[Migrate] No store file at {path}")
+        return
+    data = path.read_bytes()
+    source_format = detect_format(data) if data.strip() else file_format
+    if backup:
+        shutil.copy2(path, path.with_name(path.name + ".bak"))
+    count = FileSessionStore(base_dir=base_dir, file_format=file_format).rewrite()
+    print(
+        f"[Migrate] {count} session(s) converted from {source_format} to {file_format}: "
+        f"{len(data)} -> {path.stat().st_size} bytes"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert the file session store to another format")
+    parser.add_argument("--format", choices=FORMATS, required=True, help="target format")
+    parser.add_argument("--base-dir", default="sessions", help="session store directory")
+    parser.add_argument("--no-backup", action="store_true", help="do not keep a copy at sessions_store.json.bak")
+    args = parser.parse_args()
+
+    migrate(args.base_dir, args.format, backup=not args.no_backup)
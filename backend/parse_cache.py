@@ -0,0 +1,101 @@
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Any, Optional
+
+
+def file_sha256(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """SHA-256 of a file's bytes, read in chunks."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class ParseCache:
+    """
+    Content-addressed cache of parse_doc results on local disk.
+    The key covers the bytes of every input file, the extra instruction and a version string
+    (model + prompt), so re-uploading the same document returns the stored result.
+    Entries are evicted least-recently-used once the cache grows over max_bytes.
+    """
+
+    def __init__(self, cache_dir: str = "parse_cache", max_bytes: int = 256 * 1024 * 1024):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def key(self, file_hashes: list[str], instruction: Optional[str], version: str) -> str:
+        """Builds the cache key from the input file hashes (in order), instruction and version."""
+        payload = json.dumps([file_hashes, instruction or "", version], separators=(",", ":"))
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str, count_miss: bool = True) -> Optional[dict[str, Any]]:
+        """
+        Returns the cached result, or None. A hit marks the entry as recently used.
+        - count_miss: False for lookups that fall back to a parse_doc call counting the miss itself
+        """
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                result = json.load(f)
+        except (FileNotFoundError, ValueError):
+            if count_miss:
+                with self._lock:
+                    self.misses += 1
+            return None
+        try:
+            os.utime(path)  # recency for LRU eviction
+        except FileNotFoundError:
+            pass
+        with self._lock:
+            self.hits += 1
+        return result
+
+    def put(self, key: str, result: dict[str, Any]) -> None:
+        """Stores a result atomically and evicts old entries if the cache is over its size limit."""
+        path = self._path(key)
+        # Created on first use, so importing the module leaves the working directory alone
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f".{threading.get_ident()}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False)
+        os.replace(tmp, path)
+        self._evict()
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        return {"hits": hits, "misses": misses}
+
+    # --- internal ---
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.json"
+
+    def _evict(self) -> None:
+        with self._lock:
+            entries = []
+            total = 0
+            for path in self.cache_dir.glob("*.json"):
+                try:
+                    st = path.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+            if total <= self.max_bytes:
+                return
+            for _, size, path in sorted(entries):
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+                total -= size
+                if total <= self.max_bytes:
+                    break
@@ -1,36 +1,153 @@
-from openai import OpenAI
+from __future__ import annotations
+
 import mimetypes
+import base64
+import hashlib
+import io
 import json
 import os
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
-from typing import Any, cast
+from typing import Any, TYPE_CHECKING, cast
 
 from dotenv import load_dotenv
-from pdf2image import convert_from_path  # pyright: ignore[reportUnknownVariableType]
 
+import metrics
+from api_client import LazyClient, RateLimitedClient, parse_rate_limits, pooled_http_client
+from parse_cache import ParseCache, file_sha256
 
-from openai.types.responses import Response, ResponseInputParam
-from openai.types.responses.response_input_message_content_list_param import (
-    ResponseInputMessageContentListParam,
-)
-from openai.types.responses.response_input_text_param import ResponseInputTextParam
-from openai.types.responses.response_input_image_param import ResponseInputImageParam
+# The OpenAI SDK, pdf2image and Pillow are imported when a document is parsed,
+# so processes that only use the store or the parse cache start quickly
+if TYPE_CHECKING:
+    from PIL import Image
+    from openai.types.responses import Response, ResponseInputParam
+    from openai.types.responses.response_input_message_content_list_param import (
+        ResponseInputMessageContentListParam,
+    )
+    from openai.types.responses.response_input_text_param import ResponseInputTextParam
+    from openai.types.responses.response_input_image_param import ResponseInputImageParam
 
 # Load environment variables from the .env file
 load_dotenv()
 
-client = OpenAI()  # waits for the key in the environment variable OPENAI_API_KEY
+# Rate limits per endpoint, e.g. OPENAI_RATE_LIMITS="files.create=5,responses.create=2" (requests per second)
+OPENAI_MAX_CONCURRENCY = int(os.environ.get("OPENAI_MAX_CONCURRENCY", "8"))
+
+
+def _create_client() -> Any:
+    from openai import OpenAI
+    # waits for the key in the environment variable OPENAI_API_KEY; retries are done by the wrapper
+    return OpenAI(max_retries=0, http_client=pooled_http_client(OPENAI_MAX_CONCURRENCY))
+
+
+def _rate_limited(client: Any) -> RateLimitedClient:
+    from openai import APIConnectionError
+    return RateLimitedClient(
+        client,
+        api="openai",
+        rate_limits=parse_rate_limits(os.environ.get("OPENAI_RATE_LIMITS", "")),
+        max_concurrency=OPENAI_MAX_CONCURRENCY,
+        max_retries=int(os.environ.get("API_MAX_RETRIES", "4")),
+        # files.create is left out: a retried upload could leave an orphaned file behind
+        idempotent={"responses.create", "files.delete"},
+        connection_errors=(APIConnectionError,),
+    )
+
+
+# The rate limited OpenAI client, created on first use (needs OPENAI_API_KEY)
+client = LazyClient(_create_client, _rate_limited)
+
+# Number of PDF page ranges rendered at once (each range is its own pdftoppm process)
+RENDER_WORKERS = int(os.environ.get("PARSE_RENDER_WORKERS", str(os.cpu_count() or 1)))
+# Number of files uploaded to OpenAI at once
+UPLOAD_WORKERS = int(os.environ.get("PARSE_UPLOAD_WORKERS", "4"))
+
+# Rendering resolution of PDF pages
+PDF_DPI = int(os.environ.get("PARSE_PDF_DPI", "150"))
+# The vision model fits images into 2048x2048 and then scales the short side down to 768,
+# so larger pages only cost bytes
+MAX_IMAGE_SIDE = int(os.environ.get("PARSE_MAX_IMAGE_SIDE", "2048"))
+MAX_IMAGE_SHORT_SIDE = int(os.environ.get("PARSE_MAX_IMAGE_SHORT_SIDE", "768"))
+JPEG_QUALITY = int(os.environ.get("PARSE_JPEG_QUALITY", "85"))
+# "upload": send images through the Files API, "inline": embed them as base64 data URLs
+IMAGE_TRANSPORT = os.environ.get("PARSE_IMAGE_TRANSPORT", "upload")
+
+# Shared pools: page rendering, and deleting uploaded files after the response is received
+_render_executor = ThreadPoolExecutor(max_workers=RENDER_WORKERS, thread_name_prefix="parse-render")
+_cleanup_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="parse-cleanup")
+
+PARSE_MODEL = "gpt-5"
+BASE_INSTRUCTION = (
+    "Extract key information from ALL provided documents and return ONE combined strict JSON with fields: "
+    "patient_name (use first document's patient name), doctor_name (use first document's doctor name), diagnoses (combine unique items into a string), "
+    "medications (combine unique items into a string) add everything that is related to medications, form, dosage, duration, instructions, "
+    "recommendations (combine all recommendations into one string) and full_text (combine all texts into one string). "
+    "If a field is unknown, use null or []. Try to get as much information as possible. "
+    "Because in future you will be asked to explain this information for a person who doesn't know anything about the document and he is not a doctor. "
+    "You will be guiding the user on how to use the information and what to do with it. be very precise and detailed. Do not use arrays, instead use a string. Do not use lists, instead use a string."
+)
+
+# Cached results are only reused for the same model and prompt
+PARSE_VERSION = PARSE_MODEL + ":" + hashlib.sha256(BASE_INSTRUCTION.encode("utf-8")).hexdigest()[:16]
 
-def parse_doc(file_paths: list[str], instruction: str | None = None) -> dict[str, Any]:
+parse_cache = ParseCache(
+    os.environ.get("PARSE_CACHE_DIR", "parse_cache"),
+    max_bytes=int(os.environ.get("PARSE_CACHE_MAX_MB", "256")) * 1024 * 1024,
+)
+
+PARSE_SECONDS = metrics.histogram("parse_doc_seconds", "Time to parse documents without the cache")
+PARSE_STAGE_SECONDS = metrics.histogram(
+    "parse_doc_stage_seconds", "Time per parse_doc stage: render, encode, upload, model", ("stage",)
+)
+metrics.callback("parse_cache_lookups_total", "Parse cache lookups", parse_cache.stats, "result", kind="counter")
+
+def parse_doc(
+    file_paths: list[str], instruction: str | None = None, use_cache: bool = True,
+    file_hashes: list[str] | None = None,
+) -> dict[str, Any]:
     """
     Loads multiple PDFs/images and returns combined parsed data (JSON).
     - file_paths: list of paths to files (.pdf, .png, .jpg, .jpeg, .webp, .tiff and etc.)
     - instruction: what to extract (optional)
+    - use_cache: return the stored result for identical files and instruction, and store new results
+    - file_hashes: SHA-256 of each file when already known (e.g. hashed on upload), so the files are not read again for the cache key
     """
-    content_items: list[ResponseInputMessageContentListParam] = []
-    temp_files: list[str] = []  # for storing paths to temporary files
+    if not use_cache:
+        return _parse_doc(file_paths, instruction)
+
+    key = parse_cache_key(file_paths, instruction, file_hashes)
+    cached = parse_cache.get(key)
+    if cached is not None:
+        return cached
+    result = _parse_doc(file_paths, instruction)
+    parse_cache.put(key, result)
+    return result
+
+
+def parse_cache_key(file_paths: list[str], instruction: str | None = None, file_hashes: list[str] | None = None) -> str:
+    """Cache key of a parse_doc call: hashes of the file contents, the instruction and PARSE_VERSION."""
+    for file_path in file_paths:
+        if not Path(file_path).is_file():
+            raise FileNotFoundError(file_path)
+    if file_hashes is None:
+        file_hashes = [file_sha256(path) for path in file_paths]
+    return parse_cache.key(file_hashes, instruction, PARSE_VERSION)
+
+
+def get_cached_parse(
+    file_paths: list[str], instruction: str | None = None, file_hashes: list[str] | None = None
+) -> dict[str, Any] | None:
+    """Returns the cached parse_doc result without parsing anything, or None."""
+    return parse_cache.get(parse_cache_key(file_paths, instruction, file_hashes), count_miss=False)
+
+
+@PARSE_SECONDS.time()
+def _parse_doc(file_paths: list[str], instruction: str | None = None) -> dict[str, Any]:
     openai_file_ids: list[str] = []  # for storing OpenAI file IDs
-    
+    # One prompt item per page/image, in prompt order; pages are sent while later pages still render
+    images: list[Future[tuple[ResponseInputImageParam, str | None]]] = []
+    upload_executor = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS, thread_name_prefix="parse-upload")
+
     try:
         for file_path in file_paths:
             p = Path(file_path)
@@ -45,52 +162,40 @@ def parse_doc(file_paths: list[str], instruction: str | None = None) -> dict[str
                     mime = "image/png"
 
             if mime == "application/pdf":
-                images = transform_pdf_to_images(p.as_posix())
-                temp_files.extend(images)  # save paths to temporary files
-                for image in images:
-                    with open(image, "rb") as f:
-                        up = client.files.create(file=f, purpose="vision")
-                        openai_file_ids.append(up.id)  # save OpenAI file ID
-                        content_items.append([
-                            cast(ResponseInputImageParam, {
-                                "type": "input_image", "file_id": up.id, "detail": "auto"},
-                        )])
+                for rendered in render_pdf_pages(p.as_posix()):
+                    images.extend(
+                        upload_executor.submit(image_input, page, f"{p.stem}_page.jpg", "image/jpeg")
+                        for page in rendered.result()
+                    )
             else:
-                with open(p, "rb") as f:
-                    up = client.files.create(file=f, purpose="vision")
-                    openai_file_ids.append(up.id)  # save OpenAI file ID
-                    content_items.append([
-                        cast(
-                            ResponseInputImageParam,
-                            {"type": "input_image", "file_id": up.id, "detail": "auto"},
-                        ),
-                    ])
-
-        base_instruction = (
-            "Extract key information from ALL provided documents and return ONE combined strict JSON with fields: "
-            "patient_name (use first document's patient name), doctor_name (use first document's doctor name), diagnoses (combine unique items into a string), "
-            "medications (combine unique items into a string) add everything that is related to medications, form, dosage, duration, instructions, "
-            "recommendations (combine all recommendations into one string) and full_text (combine all texts into one string). "
-            "If a field is unknown, use null or []. Try to get as much information as possible. "
-            "Because in future you will be asked to explain this information for a person who doesn't know anything about the document and he is not a doctor. "
-            "You will be guiding the user on how to use the information and what to do with it. be very precise and detailed. Do not use arrays, instead use a string. Do not use lists, instead use a string."
-        )
+                page, page_mime = load_image(p.as_posix(), mime)
+                images.append(upload_executor.submit(image_input, page, p.name, page_mime))
+
+        content_items: list[ResponseInputImageParam] = []
+        for image in images:
+            item, file_id = image.result()
+            if file_id:
+                openai_file_ids.append(file_id)  # save OpenAI file ID
+            content_items.append(item)
+
+        base_instruction = BASE_INSTRUCTION
         if instruction:
             base_instruction = instruction + "\n\n" + base_instruction
 
         content: ResponseInputMessageContentListParam = [
-            cast(ResponseInputTextParam, {"type": "input_text", "text": base_instruction}),
-            *[item for sublist in content_items for item in sublist],
+            cast("ResponseInputTextParam", {"type": "input_text", "text": base_instruction}),
+            *content_items,
         ]
 
         input_items: ResponseInputParam = [
             {"type": "message", "role": "user", "content": content}
         ]
-        resp: Response = client.responses.create(
-            model="gpt-5",
-            input=input_items,
-            text={"format": {"type": "json_object"}},
-        )
+        with PARSE_STAGE_SECONDS.time(stage="model"):
+            resp: Response = client.get().responses.create(
+                model=PARSE_MODEL,
+                input=input_items,
+                text={"format": {"type": "json_object"}},
+            )
 
         text = resp.output_text
 
@@ -100,9 +205,30 @@ def parse_doc(file_paths: list[str], instruction: str | None = None) -> dict[str
         return json.loads(text)
 
     finally:
-        # Clean up all temporary files and OpenAI files
-        cleanup_local_files(temp_files)
-        cleanup_openai_files(openai_file_ids)
+        # Uploads finished after an error still have to be deleted
+        upload_executor.shutdown(wait=True)
+        for image in images:
+            if image.done() and image.exception() is None:
+                file_id = image.result()[1]
+                if file_id and file_id not in openai_file_ids:
+                    openai_file_ids.append(file_id)
+        # OpenAI files are deleted in the background
+        if openai_file_ids:
+            _cleanup_executor.submit(cleanup_openai_files, openai_file_ids)
+
+
+def image_input(data: bytes, name: str, mime: str) -> tuple[ResponseInputImageParam, str | None]:
+    """
+    Builds the prompt item for one image, sent inline or uploaded depending on IMAGE_TRANSPORT
+    Returns: prompt item and the OpenAI file ID to delete afterwards (None for inline images)
+    """
+    if IMAGE_TRANSPORT == "inline":
+        url = f"data:{mime};base64,{base64.b64encode(data).decode('ascii')}"
+        return cast("ResponseInputImageParam", {"type": "input_image", "image_url": url, "detail": "auto"}), None
+
+    with PARSE_STAGE_SECONDS.time(stage="upload"):
+        up = client.get().files.create(file=(name, data, mime), purpose="vision")
+    return cast("ResponseInputImageParam", {"type": "input_image", "file_id": up.id, "detail": "auto"}), up.id
 
 
 def cleanup_openai_files(file_ids: list[str]) -> None:
@@ -112,32 +238,81 @@ def cleanup_openai_files(file_ids: list[str]) -> None:
     """
     for file_id in file_ids:
         try:
-            client.files.delete(file_id)
+            client.get().files.delete(file_id)
         except Exception as e:
             print(f"Error deleting file {file_id} from OpenAI: {e}")
 
-def cleanup_local_files(file_paths: list[str]) -> None:
+def vision_size(width: int, height: int) -> tuple[int, int]:
     """
-    Deletes local files
-    - file_paths: list of file paths to delete
+    Size the vision model actually looks at: fit into MAX_IMAGE_SIDE, then short side down to MAX_IMAGE_SHORT_SIDE
+    Returns: (width, height), never larger than the input
     """
-    for path in file_paths:
-        try:
-            os.remove(path)
-        except Exception as e:
-            print(f"Error deleting local file {path}: {e}")
+    scale = min(1.0, MAX_IMAGE_SIDE / max(width, height), MAX_IMAGE_SHORT_SIDE / min(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def encode_image(image: Image.Image) -> bytes:
+    """
+    Downscales an image to vision_size and encodes it as JPEG in memory
+    Returns: JPEG bytes
+    """
+    from PIL import Image
+
+    size = vision_size(image.width, image.height)
+    if size != image.size:
+        image = image.resize(size, Image.Resampling.LANCZOS)
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    buf = io.BytesIO()
+    image.save(buf, "JPEG", quality=JPEG_QUALITY, optimize=True)
+    return buf.getvalue()
+
 
-def transform_pdf_to_images(file_path: str) -> list[str]:
+def load_image(file_path: str, mime: str) -> tuple[bytes, str]:
     """
-    Transforms a PDF file to a list of images.
+    Reads an image file, re-encoding it only if it is larger than the vision model uses
+    Returns: (image bytes, mime type)
+    """
+    from PIL import Image
+
+    with Image.open(file_path) as image:
+        if vision_size(image.width, image.height) != image.size:
+            return encode_image(image), "image/jpeg"
+    with open(file_path, "rb") as f:
+        return f.read(), mime
+
+
+def transform_pdf_to_images(file_path: str, first_page: int | None = None, last_page: int | None = None) -> list[bytes]:
+    """
+    Renders a PDF file (or a range of its pages) to in-memory JPEG images.
     - file_path: path to the PDF file
-    Returns: list of paths to generated image files
-    """
-    images = convert_from_path(file_path)
-    base_path = Path(file_path).stem
-    paths: list[str] = []
-    for i, image in enumerate(images):
-        out_path = f"{base_path}_page_{i+1}.jpg"
-        image.save(out_path, "JPEG")
-        paths.append(out_path)
-    return paths
\ No newline at end of file
+    - first_page, last_page: 1-based inclusive page range, the whole document by default
+    Returns: list of JPEG bytes, one per page
+    """
+    from pdf2image import convert_from_path, pdfinfo_from_path  # pyright: ignore[reportUnknownVariableType]
+
+    if first_page is None:
+        first_page = 1
+    if last_page is None:
+        last_page = int(pdfinfo_from_path(file_path)["Pages"])
+    # Without output_folder pdf2image reads the rendered pages from pdftoppm's stdout
+    with PARSE_STAGE_SECONDS.time(stage="render"):
+        pages = convert_from_path(file_path, dpi=PDF_DPI, first_page=first_page, last_page=last_page)
+    with PARSE_STAGE_SECONDS.time(stage="encode"):
+        return [encode_image(page) for page in pages]
+
+
+def render_pdf_pages(file_path: str) -> list[Future[list[bytes]]]:
+    """
+    Starts rendering a PDF on the render pool, split into one page range per worker.
+    - file_path: path to the PDF file
+    Returns: futures with the JPEG bytes of each range, in page order
+    """
+    from pdf2image import pdfinfo_from_path  # pyright: ignore[reportUnknownVariableType]
+
+    page_count = int(pdfinfo_from_path(file_path)["Pages"])
+    chunk = max(1, -(-page_count // RENDER_WORKERS))  # ceil division
+    return [
+        _render_executor.submit(transform_pdf_to_images, file_path, first, min(first + chunk - 1, page_count))
+        for first in range(1, page_count + 1, chunk)
+    ]
@@ -0,0 +1,428 @@
+import copy
+import heapq
+import json
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, tzinfo
+from typing import Any, Callable, Optional
+from zoneinfo import ZoneInfo
+
+import metrics
+from session_store import SessionStore
+from blob_store import load_blobs
+
+REMINDERS_FIRED = metrics.counter("reminders_fired_total", "Reminder calls by outcome", ("outcome",))
+
+# Attempts of a compare-and-set on a session's reminders before giving up
+UPDATE_ATTEMPTS = 5
+# Statuses of sessions whose reminders are scheduled; "needs_review": some schedules could not be understood
+REMINDER_STATUSES = ("initial_call_completed", "needs_review")
+
+WEEKDAYS = ("monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday")
+# Times of day the agent may capture instead of a clock time
+NAMED_TIMES = {"morning": (8, 0), "breakfast": (8, 0), "noon": (12, 0), "lunch": (12, 0), "afternoon": (15, 0),
+               "evening": (19, 0), "dinner": (19, 0), "supper": (19, 0), "bedtime": (22, 0), "night": (21, 0),
+               "midnight": (0, 0)}
+# Periods that say whether a bare hour ("7 in the morning", "evening at 8") is AM or PM
+PERIODS = "morning|afternoon|evening|tonight|night"
+# Hours (12-hour clock) that make sense with each period; "2 in the evening" is more likely a dose than 14:00
+PERIOD_HOURS = {"morning": range(4, 12), "afternoon": (12, 1, 2, 3, 4, 5, 6), "evening": range(4, 12),
+                "tonight": (6, 7, 8, 9, 10, 11, 12, 1, 2, 3, 4), "night": (6, 7, 8, 9, 10, 11, 12, 1, 2, 3, 4)}
+HOUR_WORDS = ("one", "two", "three", "four", "five", "six", "seven", "eight", "nine", "ten", "eleven", "twelve")
+MINUTE_WORDS = {"fifteen": 15, "thirty": 30, "forty-five": 45, "forty five": 45}
+
+_CLOCK = r"(?P<hour>\d{1,2})(?:[:.](?P<minute>\d{2}))?(?:\s*(?P<ampm>[ap])\.?\s*m\b\.?)?"
+_HOUR_THEN_PERIOD = re.compile(
+    rf"\b{_CLOCK}\s*(?:o'?clock\s*)?(?:in the|at|this|every|each)?\s*(?P<period>{PERIODS})\b", re.IGNORECASE
+)
+_PERIOD_THEN_HOUR = re.compile(
+    rf"\b(?P<period>{PERIODS})\s*(?:at|around|by)\s*{_CLOCK}(?:\s*o'?clock)?", re.IGNORECASE
+)
+_AM_PM = re.compile(r"\b(\d{1,2})(?:[:.](\d{2}))?\s*([ap])\.?\s*m\b\.?", re.IGNORECASE)
+# Only unambiguous 24-hour times: "08:00", "12:30", "19:00" (a bare "8:00" or "10:30" could be AM or PM)
+_24_HOUR = re.compile(r"\b(0\d|1[2-9]|2[0-3])[:.](\d{2})\b")
+_NAMED = re.compile(rf"\b({'|'.join(NAMED_TIMES)})\b", re.IGNORECASE)
+_SPELLED = re.compile(
+    rf"\b({'|'.join(HOUR_WORDS)})(?:[\s-]({'|'.join(MINUTE_WORDS)}))?\b", re.IGNORECASE
+)
+# Numbers that are not times: doses ("2 pills at 8 am")
+_NUMBER = re.compile(
+    r"\b\d{1,2}(?:[:.]\d{2})?\b(?!\s*(?:pills?|tablets?|capsules?|caps?|mg|mcg|ml|doses?|drops?|units?|puffs?|tsp|tbsp)\b)",
+    re.IGNORECASE,
+)
+# Schedules the reminder entries cannot express: exceptions, intervals, counts per day, relative times
+_UNSUPPORTED = re.compile(
+    r"\b(?:except|excluding|other than|but|not on|skip\w*|every\s+(?:\w+\s+)?hours?|hourly|every other|alternate"
+    r"|(?:twice|thrice|\w+ times)\s+(?:a|per|each)\s+(?:day|week)|half past|quarter (?:past|to|after)"
+    r"|\w+ (?:minutes )?(?:past|to|after|before)\s+\d|as needed)\b",
+    re.IGNORECASE,
+)
+
+
+def _period_hour(match: "re.Match[str]") -> Optional[int]:
+    """
+    24-hour clock hour of an hour said with a period of the day; an explicit AM/PM wins.
+    None if the hour does not fit the period ("2 in the evening").
+    """
+    hour, period = int(match.group("hour")), match.group("period")
+    if match.group("ampm"):
+        return hour % 12 + (12 if match.group("ampm") == "p" else 0)
+    if hour not in PERIOD_HOURS[period]:
+        return None
+    if period == "morning":
+        return hour % 12
+    if period in ("night", "tonight") and (hour < 5 or hour == 12):
+        return hour % 12  # "2 at night", "12 at night"
+    return hour % 12 + 12
+
+
+def _spelled_to_digits(match: "re.Match[str]") -> str:
+    hour = HOUR_WORDS.index(match.group(1).lower()) + 1
+    minute = match.group(2)
+    return f"{hour}:{MINUTE_WORDS[minute.lower()]:02d}" if minute else str(hour)
+
+
+def parse_schedule_times(text: str) -> list[dict[str, Any]]:
+    """
+    Parses a spoken schedule like "8:00 AM every day", "seven in the morning" or "morning and evening on Mondays".
+    Returns one {"hour", "minute", "weekdays"} per time of day mentioned, in the order spoken
+    (weekdays 0=Monday, all days if not mentioned).
+    Returns [] (the schedule needs review) if no time of day could be found or the schedule is not a plain
+    list of times: a bare hour without AM/PM or period ("at 8"), an hour that does not fit its period,
+    a named time next to clock times ("7 am and evening"), exceptions ("except Sunday"), intervals
+    ("every 12 hours"), counts ("twice a day") and relative times ("half past seven").
+    """
+    lowered = re.sub(r"\b12\s*(noon|midnight)\b", r"\1", text.lower())
+    lowered = _SPELLED.sub(_spelled_to_digits, lowered)
+    if _UNSUPPORTED.search(lowered):
+        return []
+    found: list[tuple[int, int, int]] = []  # (position, hour, minute)
+    taken: list[tuple[int, int]] = []
+
+    def overlaps(match: "re.Match[str]") -> bool:
+        return any(match.start() < end and start < match.end() for start, end in taken)
+
+    def add(match: "re.Match[str]", hour: int, minute: int) -> None:
+        if not overlaps(match):  # else part of a time that was already found
+            taken.append(match.span())
+            found.append((match.start(), hour, minute))
+
+    for pattern in (_HOUR_THEN_PERIOD, _PERIOD_THEN_HOUR):
+        for match in pattern.finditer(lowered):
+            hour = _period_hour(match)
+            if hour is None:
+                return []
+            add(match, hour, int(match.group("minute") or 0))
+    for match in _AM_PM.finditer(lowered):
+        add(match, int(match.group(1)) % 12 + (12 if match.group(3) == "p" else 0), int(match.group(2) or 0))
+    for match in _24_HOUR.finditer(lowered):
+        add(match, int(match.group(1)), int(match.group(2)))
+    if any(not overlaps(match) for match in _NUMBER.finditer(lowered)):
+        return []  # an hour that is not part of any time found
+    named = [match for match in _NAMED.finditer(lowered) if not overlaps(match)]
+    if named and found:
+        return []  # "7 am and evening": the named time may be a dose or only a hint
+    for match in named:
+        add(match, *NAMED_TIMES[match.group(1)])
+
+    if "weekday" in lowered:
+        weekdays = [0, 1, 2, 3, 4]
+    elif "weekend" in lowered:
+        weekdays = [5, 6]
+    else:
+        weekdays = [i for i, day in enumerate(WEEKDAYS) if re.search(rf"\b{day[:3]}({day[3:]})?s?\b", lowered)]
+
+    times = []
+    for _, hour, minute in sorted(found):
+        entry = {"hour": hour, "minute": minute, "weekdays": weekdays or list(range(7))}
+        if hour > 23 or minute > 59:
+            return []
+        if entry not in times:
+            times.append(entry)
+    return times
+
+
+def next_fire_time(reminder: dict[str, Any], after: float, tz: Optional[tzinfo] = None) -> float:
+    """Returns the first timestamp strictly after `after` matching the reminder's time and weekdays."""
+    # Naive local time when tz is None; wall-clock arithmetic keeps the hour across DST changes
+    now = datetime.fromtimestamp(after, tz)
+    candidate = now.replace(hour=reminder["hour"], minute=reminder["minute"], second=0, microsecond=0)
+    for _ in range(8):
+        if candidate.timestamp() > after and candidate.weekday() in reminder["weekdays"]:
+            return candidate.timestamp()
+        candidate = (candidate + timedelta(days=1)).replace(hour=reminder["hour"], minute=reminder["minute"])
+    raise ValueError(f"Reminder has no valid weekdays: {reminder}")
+
+
+def build_reminders(call_schedules: Any, now: float, tz: Optional[tzinfo] = None) -> list[dict[str, Any]]:
+    """
+    Turns the callSchedules captured in the first call into reminder entries with next_fire_at set.
+    - call_schedules: "not required", a JSON array string or a list of {"medicationName", "time"}
+    A schedule gets one reminder per time of day it mentions ("morning and evening": two).
+    Schedules that cannot be understood are kept with next_fire_at None and needs_review True;
+    the session is then marked "needs_review" until they are replaced (PUT /api/sessions/<id>/reminders).
+    """
+    if not call_schedules or call_schedules == "not required":
+        return []
+    if isinstance(call_schedules, str):
+        try:
+            call_schedules = json.loads(call_schedules)
+        except json.JSONDecodeError:
+            print(f"[Reminders] Could not parse callSchedules: {call_schedules!r}")
+            return [_unparsed_reminder("", call_schedules)]
+    if isinstance(call_schedules, dict):
+        call_schedules = [call_schedules]
+    if not isinstance(call_schedules, list):
+        return [_unparsed_reminder("", str(call_schedules))]
+
+    reminders = []
+    for schedule in call_schedules:
+        if not isinstance(schedule, dict):
+            reminders.append(_unparsed_reminder("", str(schedule)))
+            continue
+        medication = schedule.get("medicationName", "")
+        spoken_time = str(schedule.get("time", ""))
+        times = parse_schedule_times(spoken_time)
+        if not times:
+            print(f"[Reminders] Could not understand reminder time {spoken_time!r}")
+            reminders.append(_unparsed_reminder(medication, spoken_time))
+        for parsed in times:
+            reminders.append({
+                "medication": medication,
+                "time": spoken_time,
+                **parsed,
+                "next_fire_at": next_fire_time(parsed, now, tz),
+                "last_fired_at": None,
+                "last_call_id": None,
+            })
+    return reminders
+
+
+def _unparsed_reminder(medication: str, spoken_time: str) -> dict[str, Any]:
+    return {
+        "medication": medication,
+        "time": spoken_time,
+        "next_fire_at": None,
+        "last_fired_at": None,
+        "last_call_id": None,
+        "needs_review": True,
+    }
+
+
+class ReminderScheduler:
+    """
+    Places medication reminder calls when they are due.
+    - call_fn: places a call with the patient data, returns the Retell call (make_patient_call)
+    - max_concurrent_calls: reminder calls being placed at once
+    - missed_grace_seconds: after downtime, reminders overdue by more than this are skipped, not called late
+    - timezone: zone the spoken reminder times are in (local time if None)
+
+    Each session's reminders are persisted in its "reminders" field with their next_fire_at.
+    Due times live in a min-heap of (next_fire_at, session_id, index), so the scheduler thread
+    sleeps until the earliest one instead of scanning sessions. Before a call is placed,
+    next_fire_at is advanced in the store: a crash mid-call skips that reminder rather than
+    calling the patient twice. Heap entries that no longer match the store are dropped when popped.
+    """
+
+    def __init__(
+        self,
+        store: SessionStore,
+        call_fn: Callable[[dict[str, Any]], Any],
+        max_concurrent_calls: int = 2,
+        missed_grace_seconds: float = 3600,
+        timezone: Optional[str] = None,
+    ):
+        self.store = store
+        self.call_fn = call_fn
+        self.missed_grace_seconds = missed_grace_seconds
+        self.tz: Optional[tzinfo] = ZoneInfo(timezone) if timezone else None
+        self._heap: list[tuple[float, str, int]] = []
+        self._wakeup = threading.Condition()
+        self._store_lock = threading.Lock()  # serializes read-modify-write of "reminders"
+        self._calls: dict[str, tuple[str, int]] = {}  # call_id -> (session_id, index)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrent_calls, thread_name_prefix="reminder-call")
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = False
+
+    def start(self) -> None:
+        """Loads pending reminders from the store and starts the scheduler thread."""
+        for status in REMINDER_STATUSES:
+            for session_id, sess in self.store.get_by_status(status).items():
+                if sess.get("reminders"):
+                    self._push_session(session_id, sess["reminders"])
+                elif sess.get("callSchedules"):
+                    # First call finished before the scheduler was running
+                    self.schedule_session(session_id)
+        self._thread = threading.Thread(target=self._run, name="reminder-scheduler", daemon=True)
+        self._thread.start()
+
+    def shutdown(self, wait: bool = True) -> None:
+        with self._wakeup:
+            self._stopped = True
+            self._wakeup.notify_all()
+        if wait and self._thread is not None:
+            self._thread.join()
+        self._executor.shutdown(wait=wait)
+
+    def schedule_session(self, session_id: str) -> int:
+        """
+        Creates reminders from the session's callSchedules after its first call.
+        Sessions that already have reminders are left alone. Returns the number of reminders scheduled.
+        If some schedules could not be understood, the session is marked "needs_review".
+        """
+        with self._store_lock:
+            sess = self.store.get(session_id)
+            if sess.get("reminders"):
+                return 0
+            reminders = build_reminders(sess.get("callSchedules"), time.time(), self.tz)
+            if not reminders:
+                return 0
+            patch: dict[str, Any] = {"reminders": reminders}
+            if any(r.get("needs_review") for r in reminders):
+                patch["status"] = "needs_review"
+                print(f"[Reminders] Session {session_id} has schedules that need review")
+            # Another scheduler process may be scheduling the same session (e.g. both starting up)
+            if self.store.compare_and_update(session_id, {"reminders": sess.get("reminders")}, patch) is None:
+                return 0
+        self._push_session(session_id, reminders)
+        print(f"[Reminders] Scheduled {len(reminders)} reminder(s) for session {session_id}")
+        return len(reminders)
+
+    def replace_schedules(self, session_id: str, call_schedules: Any) -> Optional[dict[str, Any]]:
+        """
+        Replaces a session's medication schedules, e.g. to fix ones marked needs_review.
+        - call_schedules: as captured in the first call (a list of {"medicationName", "time"})
+        Returns {"status", "reminders"}, or None if the session changed meanwhile (try again).
+        Raises FileNotFoundError for unknown sessions, ValueError if the first call has not finished.
+        """
+        with self._store_lock:
+            sess = self.store.get(session_id)
+            if sess.get("status") not in REMINDER_STATUSES:
+                raise ValueError(f"Session is '{sess.get('status')}', reminders start after the first call")
+            reminders = build_reminders(call_schedules, time.time(), self.tz)
+            status = "needs_review" if any(r.get("needs_review") for r in reminders) else "initial_call_completed"
+            patch = {"callSchedules": call_schedules, "reminders": reminders, "status": status}
+            expected = {"status": sess.get("status"), "reminders": sess.get("reminders")}
+            if self.store.compare_and_update(session_id, expected, patch) is None:
+                return None
+        # Heap entries of the old reminders no longer match the store and are dropped when popped
+        self._push_session(session_id, reminders)
+        return {"status": status, "reminders": reminders}
+
+    def complete_call(self, call_id: str, final_call_details: Any) -> Optional[str]:
+        """Records how a reminder call ended. Returns the session id, or None for unknown calls."""
+        with self._store_lock:
+            entry = self._calls.pop(call_id, None)
+            if entry is None:
+                return None
+            session_id, index = entry
+            status = final_call_details.get("call_status") if isinstance(final_call_details, dict) \
+                else getattr(final_call_details, "call_status", None)
+
+            def record_status(reminders: list[dict[str, Any]]) -> bool:
+                if index >= len(reminders) or reminders[index].get("last_call_id") != call_id:
+                    return False
+                reminders[index]["last_call_status"] = status
+                return True
+
+            self._update_reminders(session_id, record_status)
+        return session_id
+
+    def stats(self) -> dict[str, int]:
+        with self._wakeup:
+            scheduled = len(self._heap)
+        with self._store_lock:
+            calls = len(self._calls)
+        return {"scheduled": scheduled, "calls_in_progress": calls}
+
+    # --- internal ---
+
+    def _push_session(self, session_id: str, reminders: list[dict[str, Any]]) -> None:
+        with self._wakeup:
+            for index, reminder in enumerate(reminders):
+                if reminder.get("next_fire_at") is not None:
+                    heapq.heappush(self._heap, (reminder["next_fire_at"], session_id, index))
+            self._wakeup.notify()
+
+    def _push(self, fire_at: float, session_id: str, index: int) -> None:
+        with self._wakeup:
+            heapq.heappush(self._heap, (fire_at, session_id, index))
+            self._wakeup.notify()
+
+    def _run(self) -> None:
+        while True:
+            with self._wakeup:
+                while not self._stopped and (not self._heap or self._heap[0][0] > time.time()):
+                    self._wakeup.wait(self._heap[0][0] - time.time() if self._heap else None)
+                if self._stopped:
+                    return
+                fire_at, session_id, index = heapq.heappop(self._heap)
+            try:
+                self._fire(fire_at, session_id, index)
+            except Exception as e:
+                print(f"[Reminders] Reminder {index} of session {session_id} failed: {e}")
+
+    def _fire(self, fire_at: float, session_id: str, index: int) -> None:
+        now = time.time()
+        with self._store_lock:
+            sess = self.store.get(session_id)
+            reminders = sess.get("reminders") or []
+            if index >= len(reminders) or reminders[index].get("next_fire_at") != fire_at:
+                return  # stale heap entry: the reminder was changed or already fired
+            original = copy.deepcopy(reminders)
+            reminder = reminders[index]
+            reminder["next_fire_at"] = next_fire_time(reminder, now, self.tz)
+            missed = now - fire_at > self.missed_grace_seconds
+            if not missed:
+                reminder["last_fired_at"] = now
+            # Persist the next occurrence before calling, so a restart never repeats this one;
+            # compare-and-set, so only one of several scheduler processes fires it
+            if self.store.compare_and_update(session_id, {"reminders": original}, {"reminders": reminders}) is None:
+                return
+        self._push(reminder["next_fire_at"], session_id, index)
+
+        if missed:
+            REMINDERS_FIRED.inc(outcome="missed")
+            print(f"[Reminders] Skipped overdue reminder for {reminder['medication']} (session {session_id})")
+            return
+        patient_data = {**(load_blobs(self.store, sess.get("data")) or {}), "medication_reminder": {
+            "medication": reminder["medication"], "time": reminder["time"],
+        }}
+        self._executor.submit(self._call, session_id, index, patient_data)
+
+    def _call(self, session_id: str, index: int, patient_data: dict[str, Any]) -> None:
+        try:
+            phone_call = self.call_fn(patient_data)
+        except Exception as e:
+            REMINDERS_FIRED.inc(outcome="failed")
+            print(f"[Reminders] Reminder call for session {session_id} failed: {e}")
+            return
+        REMINDERS_FIRED.inc(outcome="called")
+        print(f"[Reminders] Reminder call {phone_call.call_id} placed for session {session_id}")
+        def record_call(reminders: list[dict[str, Any]]) -> bool:
+            if index >= len(reminders):
+                return False
+            reminders[index]["last_call_id"] = phone_call.call_id
+            return True
+
+        with self._store_lock:
+            self._update_reminders(session_id, record_call)
+            self._calls[phone_call.call_id] = (session_id, index)
+
+    def _update_reminders(self, session_id: str, change: Callable[[list[dict[str, Any]]], bool]) -> bool:
+        """
+        Applies change() to the session's reminders with compare-and-set on the whole list, so a concurrent
+        write by another scheduler process (e.g. _fire advancing next_fire_at) is never overwritten.
+        Re-reads and retries when the list changed meanwhile; change() returns False to leave it as is.
+        """
+        for _ in range(UPDATE_ATTEMPTS):
+            reminders = self.store.get(session_id).get("reminders") or []
+            original = copy.deepcopy(reminders)
+            if not change(reminders):
+                return False
+            if self.store.compare_and_update(session_id, {"reminders": original}, {"reminders": reminders}) is not None:
+                return True
+        print(f"[Reminders] Gave up updating reminders of session {session_id}: changed concurrently")
+        return False
@@ -0,0 +1,135 @@
+"""
+Encodings of the file store (sessions_store.json): compact JSON or msgpack.
+Each record is encoded on its own and the file is the records joined into one map,
+so a write only has to encode the sessions that changed.
+"""
+import json
+import struct
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Any, Dict, cast
+
+FORMATS = ("json", "msgpack")
+
+
+class Serializer(ABC):
+    """Encodes single session records and joins encoded records into a whole store file."""
+
+    name = ""
+
+    @abstractmethod
+    def encode(self, record: Dict[str, Any]) -> bytes: ...
+
+    @abstractmethod
+    def decode(self, data: bytes) -> Dict[str, Any]: ...
+
+    @abstractmethod
+    def join(self, encoded: Dict[str, bytes]) -> bytes:
+        """The store file for records already encoded with this serializer."""
+
+    @abstractmethod
+    def split(self, data: bytes) -> Dict[str, bytes]:
+        """Reads a store file into session_id -> encoded record."""
+
+
+class JsonSerializer(Serializer):
+    """Compact JSON (no indentation). Readable by any JSON parser, including the old indented files."""
+
+    name = "json"
+
+    def encode(self, record: Dict[str, Any]) -> bytes:
+        return json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    def decode(self, data: bytes) -> Dict[str, Any]:
+        return json.loads(data)
+
+    def join(self, encoded: Dict[str, bytes]) -> bytes:
+        # One list of parts, so each record is copied once into the file contents
+        parts = [b"{"]
+        for sid, record in encoded.items():
+            parts += (self.encode_key(sid), b":", record, b",")
+        parts[-1] = b"}" if encoded else b"{}"
+        return b"".join(parts)
+
+    def split(self, data: bytes) -> Dict[str, bytes]:
+        return {sid: self.encode(record) for sid, record in json.loads(data).items()}
+
+    @staticmethod
+    def encode_key(session_id: str) -> bytes:
+        return json.dumps(session_id, ensure_ascii=False).encode("utf-8")
+
+
+class MsgpackSerializer(Serializer):
+    """msgpack: smaller and faster than JSON. Needs the msgpack package."""
+
+    name = "msgpack"
+
+    def __init__(self) -> None:
+        try:
+            import msgpack
+        except ImportError as e:
+            raise RuntimeError("The msgpack store format needs the msgpack package (pip install msgpack)") from e
+        self._msgpack = msgpack
+
+    def encode(self, record: Dict[str, Any]) -> bytes:
+        # packb is typed Optional: it only returns None with autoreset=False
+        return cast(bytes, self._msgpack.packb(record, use_bin_type=True))
+
+    def decode(self, data: bytes) -> Dict[str, Any]:
+        return self._msgpack.unpackb(data, raw=False)
+
+    def join(self, encoded: Dict[str, bytes]) -> bytes:
+        parts = [_map_header(len(encoded))]
+        for sid, record in encoded.items():
+            parts.append(cast(bytes, self._msgpack.packb(sid)))
+            parts.append(record)
+        return b"".join(parts)
+
+    def split(self, data: bytes) -> Dict[str, bytes]:
+        # Records are sliced out of the file without decoding them
+        unpacker = self._msgpack.Unpacker(raw=False, max_buffer_size=max(len(data), 1))
+        unpacker.feed(data)
+        encoded: Dict[str, bytes] = {}
+        for _ in range(unpacker.read_map_header()):
+            sid = unpacker.unpack()
+            start = unpacker.tell()
+            unpacker.skip()
+            encoded[sid] = data[start:unpacker.tell()]
+        return encoded
+
+
+def _map_header(size: int) -> bytes:
+    if size < 16:
+        return bytes([0x80 | size])
+    if size < 2 ** 16:
+        return b"\xde" + struct.pack(">H", size)
+    return b"\xdf" + struct.pack(">I", size)
+
+
+def get_serializer(name: str) -> Serializer:
+    if name == "json":
+        return JsonSerializer()
+    if name == "msgpack":
+        return MsgpackSerializer()
+    raise ValueError(f"Unknown store format '{name}', expected one of {', '.join(FORMATS)}")
+
+
+def detect_format(data: bytes) -> str:
+    """Format of a store file's contents: JSON starts with "{", msgpack with a map header."""
+    head = data.lstrip()[:1]
+    if head == b"{":
+        return "json"
+    if head and (0x80 <= head[0] <= 0x8F or head[0] in (0xDE, 0xDF)):
+        return "msgpack"
+    raise ValueError("Unrecognized session store file format")
+
+
+def load_store_file(path: Path) -> Dict[str, Dict[str, Any]]:
+    """Reads a whole store file in any format (session_id -> session data); {} if it is missing or empty."""
+    try:
+        data = path.read_bytes()
+    except FileNotFoundError:
+        return {}
+    if not data.strip():
+        return {}
+    return get_serializer(detect_format(data)).decode(data)
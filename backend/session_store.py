@@ -0,0 +1,141 @@
+import os
+from typing import Optional, Dict, Any, Protocol, Tuple, List
+
+import metrics
+
+# Listing position: (created_at, session_id) of the last session on the previous page
+Cursor = Tuple[float, str]
+
+STORE_OP_SECONDS = metrics.histogram(
+    "session_store_op_seconds", "Time per session store operation", ("backend", "op")
+)
+
+
+class SessionStore(Protocol):
+    """Interface shared by all session store backends."""
+
+    def create(self, initial: Dict[str, Any], session_id: Optional[str] = None) -> str: ...
+
+    def get(self, session_id: str) -> Dict[str, Any]: ...
+
+    def get_by_status(self, status: str) -> Dict[str, Any]: ...
+
+    def set(self, session_id: str, data: Dict[str, Any]) -> None: ...
+
+    def update(self, session_id: str, patch: Dict[str, Any]) -> Dict[str, Any]: ...
+
+    def compare_and_update(
+        self, session_id: str, expected: Dict[str, Any], patch: Dict[str, Any]
+    ) -> Optional[Dict[str, Any]]: ...
+
+    def exists(self, session_id: str) -> bool: ...
+
+    def delete(self, session_id: str) -> None: ...
+
+    def list_sessions(
+        self,
+        status: Optional[str] = None,
+        created_after: Optional[float] = None,
+        created_before: Optional[float] = None,
+        cursor: Optional[Cursor] = None,
+        limit: int = 50,
+    ) -> List[Tuple[str, Dict[str, Any]]]: ...
+
+
+class InstrumentedSessionStore:
+    """Wraps a store and records the duration of every public operation."""
+
+    def __init__(self, store: SessionStore, backend: str):
+        self._store = store
+        self._backend = backend
+
+    def create(self, initial: Dict[str, Any], session_id: Optional[str] = None) -> str:
+        with STORE_OP_SECONDS.time(backend=self._backend, op="create"):
+            return self._store.create(initial, session_id=session_id)
+
+    def get(self, session_id: str) -> Dict[str, Any]:
+        with STORE_OP_SECONDS.time(backend=self._backend, op="get"):
+            return self._store.get(session_id)
+
+    def get_by_status(self, status: str) -> Dict[str, Any]:
+        with STORE_OP_SECONDS.time(backend=self._backend, op="get_by_status"):
+            return self._store.get_by_status(status)
+
+    def set(self, session_id: str, data: Dict[str, Any]) -> None:
+        with STORE_OP_SECONDS.time(backend=self._backend, op="set"):
+            self._store.set(session_id, data)
+
+    def update(self, session_id: str, patch: Dict[str, Any]) -> Dict[str, Any]:
+        with STORE_OP_SECONDS.time(backend=self._backend, op="update"):
+            return self._store.update(session_id, patch)
+
+    def compare_and_update(
+        self, session_id: str, expected: Dict[str, Any], patch: Dict[str, Any]
+    ) -> Optional[Dict[str, Any]]:
+        with STORE_OP_SECONDS.time(backend=self._backend, op="compare_and_update"):
+            return self._store.compare_and_update(session_id, expected, patch)
+
+    def exists(self, session_id: str) -> bool:
+        with STORE_OP_SECONDS.time(backend=self._backend, op="exists"):
+            return self._store.exists(session_id)
+
+    def delete(self, session_id: str) -> None:
+        with STORE_OP_SECONDS.time(backend=self._backend, op="delete"):
+            self._store.delete(session_id)
+
+    def list_sessions(
+        self,
+        status: Optional[str] = None,
+        created_after: Optional[float] = None,
+        created_before: Optional[float] = None,
+        cursor: Optional[Cursor] = None,
+        limit: int = 50,
+    ) -> List[Tuple[str, Dict[str, Any]]]:
+        with STORE_OP_SECONDS.time(backend=self._backend, op="list_sessions"):
+            return self._store.list_sessions(status, created_after, created_before, cursor, limit)
+
+    def __getattr__(self, name: str) -> Any:
+        # Backend-specific methods (close, compact, ...) are passed through
+        return getattr(self._store, name)
+
+
+def open_store(
+    backend: Optional[str] = None,
+    base_dir: str = "sessions",
+    instrument: bool = True,
+    blobs: Optional[bool] = None,
+) -> SessionStore:
+    """
+    Creates the session store selected by configuration.
+    - backend: "file" (single file: compact JSON, or msgpack with SESSION_FILE_FORMAT=msgpack), "log" (append-only log with in-memory index)
+      or "sqlite" (SQLite database in WAL mode, safe across processes).
+      The file store is also safe across processes on one host; the log store is single-process.
+      Defaults to the SESSION_STORE environment variable, then "file".
+    - base_dir: directory for the store files
+    - instrument: record operation durations in the metrics registry
+    - blobs: keep transcripts and document texts in side files (see blob_store);
+      defaults to the SESSION_BLOBS environment variable, then on
+    """
+    backend = backend or os.environ.get("SESSION_STORE", "file")
+    store: SessionStore
+    if backend == "file":
+        from file_store import FileSessionStore
+        store = FileSessionStore(
+            base_dir=base_dir, ext=".json", file_format=os.environ.get("SESSION_FILE_FORMAT", "json")
+        )
+    elif backend == "log":
+        from log_store import LogSessionStore
+        store = LogSessionStore(base_dir=base_dir)
+    elif backend == "sqlite":
+        from sqlite_store import SqliteSessionStore
+        store = SqliteSessionStore(base_dir=base_dir)
+    else:
+        raise ValueError(f"Unknown session store backend '{backend}'")
+    if blobs is None:
+        blobs = os.environ.get("SESSION_BLOBS", "1") != "0"
+    if blobs:
+        from blob_store import BlobSessionStore
+        store = BlobSessionStore(
+            store, base_dir=base_dir, min_bytes=int(os.environ.get("SESSION_BLOB_MIN_BYTES", "1024"))
+        )
+    return InstrumentedSessionStore(store, backend) if instrument else store
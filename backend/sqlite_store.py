@@ -0,0 +1,254 @@
+import json
+import sqlite3
+import threading
+import uuid
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Tuple
+
+from serializers import load_store_file
+
+
+class SqliteSessionStore:
+    """
+    SQLite session store.
+    Each session is one row (session_id, status, created_at, data as JSON); status and created_at
+    are indexed for get_by_status and list_sessions. The database runs in WAL mode,
+    so several processes (gunicorn workers, the scheduler) can read and write concurrently;
+    updates patch a single row inside SQLite instead of rewriting the whole dataset.
+    """
+
+    def __init__(self, base_dir: str = "sessions", busy_timeout_ms: int = 10000):
+        self.base_dir = Path(base_dir)
+        self.base_dir.mkdir(parents=True, exist_ok=True)
+        self.db_path = self.base_dir / "sessions_store.sqlite3"
+        self.busy_timeout_ms = busy_timeout_ms
+        self._local = threading.local()
+
+        is_new = not self.db_path.exists()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " session_id TEXT PRIMARY KEY,"
+            " status TEXT,"
+            " created_at REAL NOT NULL DEFAULT 0,"
+            " data TEXT NOT NULL)"
+        )
+        self._add_created_at_column()
+        conn.execute("CREATE INDEX IF NOT EXISTS sessions_status ON sessions (status)")
+        conn.execute("CREATE INDEX IF NOT EXISTS sessions_created ON sessions (created_at, session_id)")
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS sessions_status_created ON sessions (status, created_at, session_id)"
+        )
+        if is_new:
+            self._seed_from_json_store()
+
+    # --- public API ---
+
+    def create(self, initial: Dict[str, Any], session_id: Optional[str] = None) -> str:
+        """
+        Creates a new session and writes the initial data.
+        If session_id is not passed — generate UUID.
+        """
+        sid = session_id or str(uuid.uuid4())
+        try:
+            self._conn().execute(
+                "INSERT INTO sessions (session_id, status, created_at, data) VALUES (?, ?, ?, ?)",
+                (sid, initial.get("status"), initial.get("created_at") or 0, self._dumps(initial)),
+            )
+        except sqlite3.IntegrityError:
+            raise FileExistsError(f"Session '{sid}' already exists")
+        return sid
+
+    def get(self, session_id: str) -> Dict[str, Any]:
+        """Returns the session data. Throws FileNotFoundError if session does not exist."""
+        row = self._conn().execute(
+            "SELECT data FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        if row is None:
+            raise FileNotFoundError(f"Session '{session_id}' not found")
+        return json.loads(row[0])
+
+    def get_by_status(self, status: str) -> Dict[str, Any]:
+        """Returns the session data by status (served by the status index)."""
+        rows = self._conn().execute(
+            "SELECT session_id, data FROM sessions WHERE status = ?", (status,)
+        ).fetchall()
+        return {sid: json.loads(data) for sid, data in rows}
+
+    def set(self, session_id: str, data: Dict[str, Any]) -> None:
+        """Completely replaces the session content with the passed dictionary."""
+        cur = self._conn().execute(
+            "UPDATE sessions SET status = ?, created_at = ?, data = ? WHERE session_id = ?",
+            (data.get("status"), data.get("created_at") or 0, self._dumps(data), session_id),
+        )
+        if cur.rowcount == 0:
+            raise FileNotFoundError(f"Session '{session_id}' not found")
+
+    def update(self, session_id: str, patch: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Partial update: shallow-merge patch into existing data.
+        The merge runs inside SQLite as a single statement, so concurrent
+        updates from other processes are not lost. Returns the updated data.
+        """
+        if not patch:
+            return self.get(session_id)
+        if any('"' in key for key in patch):
+            return self._update_in_transaction(session_id, patch)  # type: ignore[return-value]
+
+        args: list[Any] = []
+        for key, value in patch.items():
+            args.extend([f'$."{key}"', self._dumps(value)])
+        placeholders = ", ".join("?, json(?)" for _ in patch)
+        set_status = ""
+        if "status" in patch:
+            set_status = ", status = ?"
+            args.append(patch["status"])
+        if "created_at" in patch:
+            set_status += ", created_at = ?"
+            args.append(patch["created_at"] or 0)
+        row = self._conn().execute(
+            f"UPDATE sessions SET data = json_set(data, {placeholders}){set_status} "
+            "WHERE session_id = ? RETURNING data",
+            (*args, session_id),
+        ).fetchone()
+        if row is None:
+            raise FileNotFoundError(f"Session '{session_id}' not found")
+        return json.loads(row[0])
+
+    def compare_and_update(
+        self, session_id: str, expected: Dict[str, Any], patch: Dict[str, Any]
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Applies the patch only if every key in expected currently has that value (missing keys count as None).
+        Returns the updated data, or None if the session did not match.
+        The check and the write share one IMMEDIATE transaction, so they are atomic across processes.
+        """
+        return self._update_in_transaction(session_id, patch, expected)
+
+    def exists(self, session_id: str) -> bool:
+        row = self._conn().execute(
+            "SELECT 1 FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        return row is not None
+
+    def delete(self, session_id: str) -> None:
+        self._conn().execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def list_sessions(
+        self,
+        status: Optional[str] = None,
+        created_after: Optional[float] = None,
+        created_before: Optional[float] = None,
+        cursor: Optional[Tuple[float, str]] = None,
+        limit: int = 50,
+    ) -> List[Tuple[str, Dict[str, Any]]]:
+        """
+        Returns up to limit sessions, newest first, with created_after <= created_at < created_before,
+        starting after the cursor. Pages are read from the (status, created_at) indexes.
+        """
+        where: list[str] = []
+        args: list[Any] = []
+        if status is not None:
+            where.append("status = ?")
+            args.append(status)
+        if created_after is not None:
+            where.append("created_at >= ?")
+            args.append(created_after)
+        if created_before is not None:
+            where.append("created_at < ?")
+            args.append(created_before)
+        if cursor is not None:
+            where.append("(created_at, session_id) < (?, ?)")
+            args.extend(cursor)
+        sql = "SELECT session_id, data FROM sessions"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY created_at DESC, session_id DESC LIMIT ?"
+        rows = self._conn().execute(sql, (*args, limit)).fetchall()
+        return [(sid, json.loads(data)) for sid, data in rows]
+
+    def close(self) -> None:
+        """Closes the connection of the calling thread."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    # --- internal ---
+
+    def _conn(self) -> sqlite3.Connection:
+        """Returns the connection of the calling thread (sqlite3 connections are not shared across threads)."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Autocommit mode: every statement is its own transaction unless BEGIN is issued
+            conn = sqlite3.connect(self.db_path, isolation_level=None, timeout=self.busy_timeout_ms / 1000)
+            conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _dumps(self, value: Any) -> str:
+        return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+    def _add_created_at_column(self) -> None:
+        """Adds and fills the created_at column in databases created before it existed."""
+        conn = self._conn()
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(sessions)")}
+        if "created_at" in columns:
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(sessions)")}
+            if "created_at" not in columns:
+                conn.execute("ALTER TABLE sessions ADD COLUMN created_at REAL NOT NULL DEFAULT 0")
+                conn.execute("UPDATE sessions SET created_at = coalesce(json_extract(data, '$.created_at'), 0)")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _seed_from_json_store(self) -> None:
+        """Imports an existing sessions_store.json so that switching the store mode keeps the data."""
+        json_path = self.base_dir / "sessions_store.json"
+        if not json_path.exists():
+            return
+        sessions = load_store_file(json_path)
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        conn.executemany(
+            "INSERT OR IGNORE INTO sessions (session_id, status, created_at, data) VALUES (?, ?, ?, ?)",
+            [(sid, data.get("status"), data.get("created_at") or 0, self._dumps(data))
+             for sid, data in sessions.items()],
+        )
+        conn.execute("COMMIT")
+
+    def _update_in_transaction(
+        self, session_id: str, patch: Dict[str, Any], expected: Optional[Dict[str, Any]] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Read-modify-write under a write lock: the fallback for keys that cannot be expressed
+        as a JSON path, and compare-and-set when expected is given.
+        """
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT data FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            if row is None:
+                raise FileNotFoundError(f"Session '{session_id}' not found")
+            data = json.loads(row[0])
+            if expected and any(data.get(key) != value for key, value in expected.items()):
+                conn.execute("ROLLBACK")
+                return None
+            data.update(patch)
+            conn.execute(
+                "UPDATE sessions SET status = ?, created_at = ?, data = ? WHERE session_id = ?",
+                (data.get("status"), data.get("created_at") or 0, self._dumps(data), session_id),
+            )
+            conn.execute("COMMIT")
+            return data
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
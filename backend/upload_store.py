@@ -0,0 +1,121 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, IO, Optional
+
+from flask import Request
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.utils import secure_filename
+
+
+class HashingFile:
+    """
+    Temporary upload file that hashes and counts bytes as they are written, and refuses
+    to grow past max_bytes. The temporary file is removed when it is closed.
+    """
+
+    def __init__(self, upload_dir: str, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._sha256 = hashlib.sha256()
+        self._file: IO[bytes] = tempfile.NamedTemporaryFile(dir=upload_dir, prefix=".incoming-", delete=True)
+
+    def write(self, data: bytes) -> int:
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            raise RequestEntityTooLarge(f"Uploaded file is larger than {self.max_bytes} bytes")
+        self._sha256.update(data)
+        return self._file.write(data)
+
+    def hexdigest(self) -> str:
+        return self._sha256.hexdigest()
+
+    def __getattr__(self, name: str) -> Any:
+        # read/seek/tell/close/name for werkzeug's FileStorage
+        return getattr(self._file, name)
+
+    def __iter__(self) -> Any:
+        return iter(self._file)
+
+
+class UploadRequest(Request):
+    """
+    Request whose multipart file parts are written straight into HashingFiles in the upload
+    directory, so an upload is read once, hashed on the way in and capped at max_file_bytes.
+    """
+
+    upload_dir = "uploaded_notes"
+    max_file_bytes = 25 * 1024 * 1024
+
+    def _get_file_stream(  # type: ignore[override]
+        self, total_content_length: Optional[int], content_type: Optional[str],
+        filename: Optional[str] = None, content_length: Optional[int] = None,
+    ) -> Any:
+        return HashingFile(self.upload_dir, self.max_file_bytes)
+
+
+@dataclass
+class StoredUpload:
+    path: str
+    sha256: str
+    size: int
+    original_filename: str
+    duplicate: bool  # the same content was uploaded before
+
+
+def store_upload(stream: IO[bytes], filename: str, upload_dir: str) -> StoredUpload:
+    """
+    Gives a received upload its content-addressed name, <sha256><ext> in upload_dir.
+    Identical content is stored once: a later upload of it only gets the existing path.
+    - stream: the file stream of a request parsed by UploadRequest (a HashingFile)
+    Raises OSError if the file cannot be stored.
+    """
+    if not isinstance(stream, HashingFile):
+        raise TypeError("store_upload needs a HashingFile stream; is the app's request_class UploadRequest?")
+    sha256 = stream.hexdigest()
+    ext = Path(secure_filename(filename)).suffix.lower()
+    path = os.path.join(upload_dir, f"{sha256}{ext}")
+    stream.flush()
+    os.fsync(stream.fileno())
+    try:
+        # The hard link keeps the bytes when the temporary file is closed and removed
+        os.link(stream.name, path)
+        duplicate = False
+    except FileExistsError:
+        duplicate = True
+    except OSError as e:
+        # The file system does not support hard links: copy, then rename into place atomically
+        print(f"[Upload] Hard link failed ({e}), copying {stream.name}")
+        duplicate = not _copy_into_place(stream.name, path)
+    return StoredUpload(path, sha256, stream.size, filename, duplicate)
+
+
+def store_file(source: str, sha256: str, upload_dir: str) -> StoredUpload:
+    """
+    Copies a local document (e.g. from a backfill directory) into upload_dir under its
+    content-addressed name, as if it had been uploaded, so the session does not depend on the source.
+    - sha256: the file's hash, already computed by the caller
+    """
+    ext = Path(secure_filename(os.path.basename(source))).suffix.lower()
+    path = os.path.join(upload_dir, f"{sha256}{ext}")
+    os.makedirs(upload_dir, exist_ok=True)
+    duplicate = not _copy_into_place(source, path)
+    return StoredUpload(path, sha256, os.path.getsize(path), os.path.basename(source), duplicate)
+
+
+def _copy_into_place(source: str, path: str) -> bool:
+    """Copies source to path through a temporary name and an atomic rename. False if path already exists."""
+    if os.path.exists(path):
+        return False
+    tmp = os.path.join(os.path.dirname(path), f".copy-{uuid.uuid4().hex}")
+    try:
+        shutil.copyfile(source, tmp)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return True